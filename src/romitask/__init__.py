@@ -1,13 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from romitask.task import RomiTask
-from romitask.task import FilesetTarget
-from romitask.task import DatabaseConfig
-
 #: Name of the object configuration file:
 OBJECT_TOML = "object.toml"
 #: Name of the scan backup configuration file:
 SCAN_TOML = "scan.toml"
 #: Name of the pipeline backup configuration file:
 PIPE_TOML = "pipeline.toml"
+
+#: Public names lazily imported from their sub-module on first access.
+#: This keeps ``import romitask`` free of ``luigi``, ``tqdm`` & logger configuration.
+_LAZY_IMPORTS = {
+    "RomiTask": "romitask.task",
+    "FilesetTarget": "romitask.task",
+    "DatabaseConfig": "romitask.task",
+}
+
+__all__ = ["OBJECT_TOML", "SCAN_TOML", "PIPE_TOML"] + list(_LAZY_IMPORTS)
+
+
+def __getattr__(name):
+    """Import the public names from their sub-module on first access (PEP 562)."""
+    try:
+        module_name = _LAZY_IMPORTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    import importlib
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value  # cache it, next accesses will not go through `__getattr__`
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
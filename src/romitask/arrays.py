@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Array files utilities, using only NumPy and the standard library.
+
+Memory-mapped access to ``.npy`` files and to the members of *uncompressed* ``.npz`` archives
+gives zero-copy, read-only views of arrays larger than the available RAM.
+
+The *chunked* array format splits an array in fixed-size chunks, each compressed independently,
+so readers only decompress the chunks they need, e.g. a bounding-box crop or one channel.
+It is a ZIP archive containing:
+
+  - an ``index.json`` member with the array shape, data type, chunk shape & compression;
+  - one member per chunk, named after its grid coordinates like ``'0.2.1'``, with the raw bytes of the chunk in C order.
+
+Chunks that are on the array edges are smaller than the chunk shape.
+
+Examples
+--------
+>>> import numpy as np
+>>> from romitask.arrays import memmap_array
+>>> np.savez('/tmp/arrays.npz', a=np.arange(10), b=np.ones((2, 3)))
+>>> arrays = memmap_array('/tmp/arrays.npz')
+>>> arrays['a'][2:5]
+memmap([2, 3, 4])
+
+>>> from romitask.arrays import ChunkedArray
+>>> from romitask.arrays import write_chunked
+>>> write_chunked('/tmp/voxels.npc', np.arange(24).reshape(2, 3, 4), chunks=(1, 2, 2))
+>>> with ChunkedArray('/tmp/voxels.npc') as arr:
+...     print(arr[1, :2, 1:3])  # only decompress the 2 chunks intersecting this crop
+[[13 14]
+ [17 18]]
+"""
+
+import itertools
+import json
+import math
+import struct
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+#: Size of the fixed part of a ZIP local file header, in bytes:
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def _memmap_npy(path, offset=0, mode='r'):
+    """Memory-map an array stored in NPY format, starting at `offset` bytes in the file."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if dtype.hasobject:
+            raise ValueError(f"Can not memory-map an array of Python objects from '{path}'!")
+        data_offset = f.tell()
+    order = 'F' if fortran_order else 'C'
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape, order=order, offset=data_offset)
+
+
+def memmap_npz(path, mode='r'):
+    """Memory-map the arrays of an uncompressed NPZ archive.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the NPZ file, saved with ``numpy.savez`` (not ``numpy.savez_compressed``).
+    mode : {'r', 'r+', 'c'}, optional
+        The memory-map mode, defaults to read-only ``'r'``.
+
+    Returns
+    -------
+    dict
+        The ``numpy.memmap`` arrays indexed by name.
+
+    Raises
+    ------
+    ValueError
+        If an array of the archive is compressed.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Can not memory-map compressed array '{info.filename}' from '{path}'!")
+            # The data offset is given by the local header, its 'extra' field may differ from the central directory:
+            f.seek(info.header_offset)
+            header = f.read(_ZIP_LOCAL_HEADER_SIZE)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            offset = info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            arrays[name] = _memmap_npy(path, offset, mode)
+    return arrays
+
+
+def memmap_array(path, mode='r'):
+    """Memory-map the array(s) of an uncompressed NPY or NPZ file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the NPY or NPZ file.
+    mode : {'r', 'r+', 'c'}, optional
+        The memory-map mode, defaults to read-only ``'r'``.
+
+    Returns
+    -------
+    numpy.memmap or dict
+        The memory-mapped array for an NPY file, or a dictionary of arrays indexed by name for an NPZ file.
+
+    Raises
+    ------
+    ValueError
+        If the file extension is not supported or the arrays are compressed.
+    """
+    path = Path(path)
+    if path.suffix == '.npy':
+        return np.load(path, mmap_mode=mode)
+    elif path.suffix == '.npz':
+        return memmap_npz(path, mode)
+    else:
+        raise ValueError(f"Can not memory-map '{path.name}', only NPY & NPZ files are supported!")
+
+
+def open_memmap(path, shape, dtype='float32', fortran_order=False):
+    """Preallocate a memory-mapped NPY file to write an array.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the NPY file to create.
+    shape : tuple of int
+        Shape of the array.
+    dtype : str or numpy.dtype, optional
+        Data type of the array, defaults to ``'float32'``.
+    fortran_order : bool, optional
+        If ``True``, store the array in Fortran order, defaults to ``False``.
+
+    Returns
+    -------
+    numpy.memmap
+        The writable memory-mapped array, call its ``flush`` method when done.
+    """
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape),
+                                     fortran_order=fortran_order)
+
+
+#: Default file extension of the chunked array format:
+CHUNKED_EXT = "npc"
+#: Name of the format, as saved in the index:
+CHUNKED_FORMAT = "romitask-chunked-array"
+#: Name of the index member in the chunked array archive:
+CHUNKED_INDEX = "index.json"
+#: Default target size of an (uncompressed) chunk, in bytes:
+CHUNK_BYTES = 2 ** 20
+
+
+def default_chunks(shape, itemsize, chunk_bytes=CHUNK_BYTES):
+    """Return a chunk shape of at most `chunk_bytes`, obtained by halving its largest dimension until it fits.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the array.
+    itemsize : int
+        Size of an array element, in bytes.
+    chunk_bytes : int, optional
+        Target size of a chunk, in bytes. Defaults to ``CHUNK_BYTES``.
+
+    Returns
+    -------
+    tuple of int
+        The chunk shape.
+    """
+    chunks = [max(1, int(s)) for s in shape]
+    while int(np.prod(chunks)) * itemsize > chunk_bytes and any(c > 1 for c in chunks):
+        i = chunks.index(max(chunks))
+        chunks[i] = math.ceil(chunks[i] / 2)
+    return tuple(chunks)
+
+
+def _chunk_name(idx):
+    return ".".join(str(i) for i in idx) if len(idx) > 0 else "0"
+
+
+def write_chunked(path, arr, chunks=None, compress_level=6):
+    """Write an array in the chunked array format.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the file to write.
+    arr : numpy.ndarray
+        The array to write, it may be a ``numpy.memmap`` larger than the available RAM.
+    chunks : tuple of int, optional
+        The chunk shape, defaults to about ``CHUNK_BYTES`` per chunk (see ``default_chunks``).
+    compress_level : int or None, optional
+        The per-chunk ZIP compression level, from ``0`` (fast) to ``9`` (small).
+        Defaults to ``6``, use ``None`` to store the chunks without compression.
+
+    Raises
+    ------
+    ValueError
+        If the chunk shape does not match the array dimensions, or the array contains Python objects.
+    """
+    arr = np.asanyarray(arr)
+    if arr.dtype.hasobject:
+        raise ValueError("Can not write an array of Python objects in the chunked array format!")
+    if chunks is None:
+        chunks = default_chunks(arr.shape, arr.dtype.itemsize)
+    chunks = tuple(int(c) for c in chunks)
+    if len(chunks) != arr.ndim or any(c < 1 for c in chunks):
+        raise ValueError(f"Invalid chunk shape {chunks} for an array of shape {arr.shape}!")
+
+    if compress_level is None:
+        compression, level = zipfile.ZIP_STORED, None
+    else:
+        compression, level = zipfile.ZIP_DEFLATED, compress_level
+    index = {
+        "format": CHUNKED_FORMAT,
+        "version": 1,
+        "shape": list(arr.shape),
+        "dtype": arr.dtype.str,
+        "chunks": list(chunks),
+        "order": "C",
+        "compression": "deflate" if compress_level is not None else None,
+    }
+    grid = [range(math.ceil(s / c)) for s, c in zip(arr.shape, chunks)]
+    with zipfile.ZipFile(path, 'w', compression=compression, compresslevel=level, allowZip64=True) as zf:
+        zf.writestr(CHUNKED_INDEX, json.dumps(index), compress_type=zipfile.ZIP_STORED)
+        for idx in itertools.product(*grid):
+            sl = tuple(slice(i * c, (i + 1) * c) for i, c in zip(idx, chunks))
+            zf.writestr(_chunk_name(idx), np.ascontiguousarray(arr[sl]).tobytes())
+
+
+class ChunkedArray(object):
+    """Lazy reader of an array saved in the chunked array format.
+
+    Indexing with integers, slices & ``Ellipsis`` only decompresses the intersecting chunks.
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        Path to the chunked array file.
+    shape : tuple of int
+        Shape of the array.
+    dtype : numpy.dtype
+        Data type of the array.
+    chunks : tuple of int
+        Shape of the chunks.
+    """
+
+    def __init__(self, path):
+        """ChunkedArray constructor.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path to the chunked array file.
+
+        Raises
+        ------
+        ValueError
+            If the file is not in the chunked array format.
+        """
+        self.path = Path(path)
+        self._zf = zipfile.ZipFile(self.path, 'r')
+        try:
+            index = json.loads(self._zf.read(CHUNKED_INDEX))
+        except KeyError:
+            self._zf.close()
+            raise ValueError(f"File '{self.path}' is not in the chunked array format, missing index!") from None
+        if index.get("format") != CHUNKED_FORMAT:
+            self._zf.close()
+            raise ValueError(f"File '{self.path}' is not in the chunked array format!")
+        self.index = index
+        self.shape = tuple(index["shape"])
+        self.dtype = np.dtype(index["dtype"])
+        self.chunks = tuple(index["chunks"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"ChunkedArray('{self.path}', shape={self.shape}, dtype={self.dtype}, chunks={self.chunks})"
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def close(self):
+        """Close the underlying file."""
+        self._zf.close()
+
+    def read_chunk(self, idx):
+        """Read and decompress a single chunk.
+
+        Parameters
+        ----------
+        idx : tuple of int
+            Coordinates of the chunk in the chunk grid.
+
+        Returns
+        -------
+        numpy.ndarray
+            The chunk, smaller than the chunk shape on the array edges.
+        """
+        shape = tuple(min(c, s - i * c) for i, c, s in zip(idx, self.chunks, self.shape))
+        return np.frombuffer(self._zf.read(_chunk_name(idx)), dtype=self.dtype).reshape(shape)
+
+    def _normalize_key(self, key):
+        """Convert an indexing key to a list of ``range`` per dimension and a list of dimensions to squeeze."""
+        if not isinstance(key, tuple):
+            key = (key,)
+        n_ell = sum(k is Ellipsis for k in key)
+        if n_ell > 1:
+            raise IndexError("An index can only have a single ellipsis ('...')!")
+        if n_ell == 1:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        if len(key) > self.ndim:
+            raise IndexError(f"Too many indices for an array of dimension {self.ndim}!")
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        ranges, squeeze = [], []
+        for dim, (k, s) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                ranges.append(range(*k.indices(s)))
+            elif isinstance(k, (int, np.integer)):
+                i = int(k) + s if k < 0 else int(k)
+                if not 0 <= i < s:
+                    raise IndexError(f"Index {k} is out of bounds for axis {dim} with size {s}!")
+                ranges.append(range(i, i + 1))
+                squeeze.append(dim)
+            else:
+                raise IndexError("Only integers, slices & ellipsis are valid indices of a ChunkedArray!")
+        return ranges, squeeze
+
+    def __getitem__(self, key):
+        ranges, squeeze = self._normalize_key(key)
+        if any(len(r) == 0 for r in ranges):
+            out = np.empty([len(r) for r in ranges], dtype=self.dtype)
+            return out.squeeze(axis=tuple(squeeze)) if squeeze else out
+
+        # Read the bounding box of the selection from the intersecting chunks:
+        lo = [min(r[0], r[-1]) for r in ranges]
+        hi = [max(r[0], r[-1]) + 1 for r in ranges]
+        block = np.empty([h - l for l, h in zip(lo, hi)], dtype=self.dtype)
+        grid = [range(l // c, (h - 1) // c + 1) for l, h, c in zip(lo, hi, self.chunks)]
+        for idx in itertools.product(*grid):
+            chunk = self.read_chunk(idx)
+            src, dst = [], []
+            for i, c, l, h in zip(idx, self.chunks, lo, hi):
+                start, stop = max(i * c, l), min((i + 1) * c, h)
+                src.append(slice(start - i * c, stop - i * c))
+                dst.append(slice(start - l, stop - l))
+            block[tuple(dst)] = chunk[tuple(src)]
+
+        # Apply the steps of the selection, relative to the bounding box:
+        rel = []
+        for r, l in zip(ranges, lo):
+            stop = r[-1] - l + (1 if r.step > 0 else -1)
+            rel.append(slice(r[0] - l, stop if stop >= 0 else None, r.step))
+        out = block[tuple(rel)]
+        return out.squeeze(axis=tuple(squeeze)) if squeeze else out
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[...]
+        return arr if dtype is None else arr.astype(dtype)
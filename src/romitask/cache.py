@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Caching utilities for romitask.
+
+The user cache directory defaults to ``~/.cache/romitask``.
+It can be changed with the ``ROMITASK_CACHE_DIR`` environment variable, or follows ``XDG_CACHE_HOME`` if defined.
+"""
+
+import json
+import os
+from pathlib import Path
+
+#: Name of the environment variable used to change the cache directory:
+CACHE_DIR_ENV = "ROMITASK_CACHE_DIR"
+
+
+def get_cache_dir(create=True):
+    """Return the user cache directory of romitask.
+
+    Parameters
+    ----------
+    create : bool, optional
+        If ``True`` (default), create the directory if it does not exist.
+
+    Returns
+    -------
+    pathlib.Path
+        Path to the cache directory.
+    """
+    if os.environ.get(CACHE_DIR_ENV, ""):
+        path = Path(os.environ[CACHE_DIR_ENV])
+    else:
+        path = Path(os.environ.get("XDG_CACHE_HOME", "") or Path.home() / ".cache") / "romitask"
+    if create:
+        path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def load_json_cache(path):
+    """Load a JSON cache file, return an empty dictionary if missing or corrupted.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the JSON cache file.
+
+    Returns
+    -------
+    dict
+        The cached dictionary.
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def dump_json_cache(path, data):
+    """Atomically write a JSON cache file, failing silently on read-only locations.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the JSON cache file.
+    data : dict
+        The dictionary to cache.
+
+    Returns
+    -------
+    bool
+        ``True`` if the cache file was written, else ``False``.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)  # atomic on POSIX, concurrent readers never see a partial file
+    except OSError:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        return False
+    return True
+
+
+#: Process-level cache of parsed TOML files, indexed by path, see ``load_toml``:
+_TOML_CACHE = {}
+
+
+def load_toml(path):
+    """Load a TOML file, using a process-level cache keyed on file path and modification time.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the TOML file to load.
+
+    Returns
+    -------
+    dict
+        The parsed TOML file, as a new dictionary that can safely be modified.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file does not exist.
+
+    Notes
+    -----
+    A file is parsed again only if its modification time or size changed since last call.
+    """
+    import copy
+    import toml
+    path = Path(path).resolve()
+    st = path.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _TOML_CACHE.get(path)
+    if cached is None or cached[0] != key:
+        cached = (key, toml.load(path))
+        _TOML_CACHE[path] = cached
+    return copy.deepcopy(cached[1])
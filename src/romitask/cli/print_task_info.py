@@ -25,16 +25,28 @@
 
 """
 Python script to call after a ROMI task to print a task summary.
+
+Given several tasks, or a dataset path matching several datasets with Unix pattern matching,
+it collects the summaries in parallel and write them as a table, with one row per dataset and task.
 """
 
 import argparse
+import csv
+import glob
 import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import toml
 
-from romitask.modules import TASKS
+from romitask.modules import get_tasks
+from romitask.summary import colmap_keypoints_stats
+from romitask.summary import get_dataset_size
+from romitask.summary import get_summary
+from romitask.summary import json_metadata
+from romitask.summary import load_summary
 
 HELP_URL = "https://docs.romi-project.eu/Scanner/metadata/tasks_metadata/"
 
@@ -45,44 +57,32 @@ def parsing():
         epilog="""See {} for help with configuration files.
                                      """.format(HELP_URL))
 
-    parser.add_argument('task', metavar='task', type=str,
-                        choices=TASKS,
-                        help=f"Choose a ROMI task in: {', '.join(TASKS)}.")
+    tasks = get_tasks()
+    parser.add_argument('task', metavar='task', type=str, nargs='+',
+                        choices=tasks,
+                        help=f"Choose one or more ROMI task in: {', '.join(tasks)}.")
 
     parser.add_argument('db_path', metavar='dataset_path', type=str,
-                        help='FSDB scan dataset to process (path).')
+                        help="""FSDB scan dataset to process (path).
+                        You may use Unix pattern matching with "*" and "?" to select a list of dataset.""")
+
+    parser.add_argument('--fast', action='store_true',
+                        help="Get the PLY files vertex & face counts from their header, without loading them.")
+    parser.add_argument('--bounds', action='store_true',
+                        help="With `--fast`, also compute the dimensions from a direct read of the vertex coordinates.")
+    parser.add_argument('--details', action='store_true',
+                        help="Read the output files of a single task, even if an up-to-date summary is stored.")
+
+    table = parser.add_argument_group("table options",
+                                      "Used when summarizing several tasks or datasets, or when `--table` is given.")
+    table.add_argument('--table', type=str, default=None,
+                       help="Path to the CSV or JSON (by extension) table to write, use '-' for CSV on standard output.")
+    table.add_argument('--workers', type=int, default=None,
+                       help="Number of worker processes, defaults to the number of CPUs.")
 
     return parser
 
 
-def get_dataset_size(db_path):
-    return len([f for f in os.listdir(os.path.join(db_path, 'images')) if os.path.splitext(f)[1] in ['.jpg', '.png']])
-
-
-def json_metadata(task, task_id, db_path):
-    """ Get task metadata JSON.
-
-    Parameters
-    ----------
-    task : str
-        Name of the task.
-    task_id : str
-        Id of the tasks.
-    db_path : str
-        Path to scan dataset.
-
-    Returns
-    -------
-    str
-        JSON location.
-    dict
-        Loaded JSON dictionary
-
-    """
-    json_f = os.path.join(db_path, task_id, f"{task}.json")
-    return json_f, json.load(open(json_f, 'r'))
-
-
 def metadata_info(task, task_id, db_path):
     """Dump a JSON metadata file for a given task & dataset. """
     json_f, md_json = json_metadata(task, task_id, db_path)
@@ -106,10 +106,48 @@ def curve_skeleton_info(task, task_id, db_path):
     print(f"Found a skeleton of {len(md_json['points'])} points.")
 
 
-def pointcloud_info(task, task_id, db_path):
+def ply_header_info(ply_f, task_id, elements, bounds=False, colors=False):
+    """Print info about a PLY file from its header, without loading it.
+
+    Parameters
+    ----------
+    ply_f : str
+        Path to the PLY file.
+    task_id : str
+        Id of the tasks.
+    elements : dict
+        Name to print for the PLY elements to count, e.g. ``{'vertex': 'points'}``.
+    bounds : bool, optional
+        If ``True``, print the dimensions computed from a direct read of the vertex coordinates.
+    colors : bool, optional
+        If ``True``, print the number of unique vertex colors computed from a direct read of the vertex colors.
+    """
+    from romitask.ply import ply_vertex_bounds
+    from romitask.ply import read_ply_header
+    from romitask.ply import read_ply_vertex_fields
+    header = read_ply_header(ply_f)
+    counts = header.counts()
+    if counts.get('vertex', 0) == 0:
+        print(f"PLY file for task '{task_id}' is empty!")
+    else:
+        print(f"Found PLY file for task '{task_id}':")
+    for element, name in elements.items():
+        print(f" - {counts.get(element, 0)} {name}")
+    if colors:
+        rgb = read_ply_vertex_fields(ply_f, ('red', 'green', 'blue'), header)
+        print(f" - {len(np.unique(rgb, axis=0))} unique colors")
+    if bounds:
+        min_bound, max_bound = ply_vertex_bounds(ply_f, header)
+        if min_bound is not None:
+            print(f" - dimensions (x, y, z): {max_bound - min_bound}")
+
+
+def pointcloud_info(task, task_id, db_path, fast=False, bounds=False):
     """Print info about PointCloud task output."""
-    from plantdb.io import read_point_cloud
     ply_f = os.path.join(db_path, task_id, f"{task}.ply")
+    if fast:
+        return ply_header_info(ply_f, task_id, {'vertex': 'points'}, bounds)
+    from plantdb.io import read_point_cloud
     ply = read_point_cloud(ply_f)
     if ply.is_empty():
         print(f"PLY file for task '{task_id}' is empty!")
@@ -119,10 +157,12 @@ def pointcloud_info(task, task_id, db_path):
     print(f" - pointcloud dimensions (x, y, z): {ply.get_max_bound() - ply.get_min_bound()}")
 
 
-def segmented_pointcloud_info(task, task_id, db_path):
+def segmented_pointcloud_info(task, task_id, db_path, fast=False, bounds=False):
     """Print info about SegmentedPointCloud task output."""
-    from plantdb.io import read_point_cloud
     ply_f = os.path.join(db_path, task_id, f"{task}.ply")
+    if fast:
+        return ply_header_info(ply_f, task_id, {'vertex': 'points'}, bounds, colors=bounds)
+    from plantdb.io import read_point_cloud
     ply = read_point_cloud(ply_f)
     if ply.is_empty():
         print(f"PLY file for task '{task_id}' is empty!")
@@ -133,10 +173,12 @@ def segmented_pointcloud_info(task, task_id, db_path):
     print(f" - pointcloud dimensions (x, y, z): {ply.get_max_bound() - ply.get_min_bound()}")
 
 
-def triangle_mesh_info(task, task_id, db_path):
+def triangle_mesh_info(task, task_id, db_path, fast=False, bounds=False):
     """Print info about TriangleMesh task output."""
-    from plantdb.io import read_triangle_mesh
     ply_f = os.path.join(db_path, task_id, f"{task}.ply")
+    if fast:
+        return ply_header_info(ply_f, task_id, {'vertex': 'vertices', 'face': 'triangles'}, bounds)
+    from plantdb.io import read_triangle_mesh
     ply = read_triangle_mesh(ply_f)
     if ply.is_empty():
         print(f"PLY file for task '{task_id}' is empty!")
@@ -166,17 +208,21 @@ def segmentation2d_info(task, task_id, db_path):
     print("\n - ".join([f"{v}/{n_imgs} for {k}" for k, v in organs.items()]))
 
 
-def clustered_mesh_info(task, task_id, db_path):
+def clustered_mesh_info(task, task_id, db_path, fast=False):
     """Print info about ClusteredMesh task output."""
-    from plantdb.io import read_triangle_mesh
     out_dir = os.path.join(db_path, task_id)
     files = os.listdir(out_dir)
     ply_files = [f for f in files if f.endswith('.ply')]
     organs = {}
     for ply in ply_files:
         ply_f = os.path.join(db_path, task_id, ply)
-        ply_mesh = read_triangle_mesh(ply_f)
-        if ply_mesh.is_empty():
+        if fast:
+            from romitask.ply import read_ply_header
+            is_empty = read_ply_header(ply_f).counts().get('vertex', 0) == 0
+        else:
+            from plantdb.io import read_triangle_mesh
+            is_empty = read_triangle_mesh(ply_f).is_empty()
+        if is_empty:
             continue  # don't count empty PLY as valid organs!
         organ = ply.split('_')[0]
         if organ in organs.keys():
@@ -213,18 +259,35 @@ def colmap_info(task, task_id, db_path):
         print(json.dumps(cam_json["1"], sort_keys=True, indent=2))
 
     try:
-        imgs_json = json.load(open(os.path.join(out_dir, "images.json"), 'r'))
+        # Stream the (potentially huge) file, one image at a time:
+        stats = colmap_keypoints_stats(os.path.join(out_dir, "images.json"))
     except FileNotFoundError:
         print("Could not find COLMAP estimated camera parameters!")
     else:
-        n_xys = [len(img_json["xys"]) for _, img_json in imgs_json.items()]
-        av_n_xys = round(sum(n_xys) / len(imgs_json), 2)
-        print(f"Average number of 2D keypoints per image: {av_n_xys}")
-        print(f"Min number of 2D keypoints per image: {min(n_xys)}")
-        print(f"Max number of 2D keypoints per image: {max(n_xys)}")
+        if stats["n_images"] == 0:
+            print("No image found in COLMAP estimated camera parameters!")
+        else:
+            print(f"Average number of 2D keypoints per image: {stats['mean_keypoints']}")
+            print(f"Min number of 2D keypoints per image: {stats['min_keypoints']}")
+            print(f"Max number of 2D keypoints per image: {stats['max_keypoints']}")
 
 
-def info_from_task(task, task_id, db_path):
+def info_from_task(task, task_id, db_path, fast=False, bounds=False):
+    """Print info about a task output.
+
+    Parameters
+    ----------
+    task : str
+        Name of the task.
+    task_id : str
+        Id of the tasks.
+    db_path : str
+        Path to scan dataset.
+    fast : bool, optional
+        If ``True``, get the PLY files counts from their header, without loading them.
+    bounds : bool, optional
+        If ``True``, with `fast`, compute the PLY files dimensions from a direct read of their vertex coordinates.
+    """
     if task == "AnglesAndInternodes":
         return angles_and_internodes_info(task, task_id, db_path)
     elif task == "TreeGraph":
@@ -232,14 +295,14 @@ def info_from_task(task, task_id, db_path):
     elif task == "CurveSkeleton":
         return curve_skeleton_info(task, task_id, db_path)
     elif task == "TriangleMesh":
-        return triangle_mesh_info(task, task_id, db_path)
+        return triangle_mesh_info(task, task_id, db_path, fast, bounds)
     elif task == "PointCloud":
-        return pointcloud_info(task, task_id, db_path)
+        return pointcloud_info(task, task_id, db_path, fast, bounds)
     elif task == "Voxels":
         # Heavy NPZ file to read, not very informative...
         return NotImplementedError
     elif task == "Masks":
-        return masks_info
+        return masks_info(task, task_id, db_path)
     elif task == "Colmap":
         return colmap_info(task, task_id, db_path)
     elif task == "Undistorted":
@@ -248,9 +311,9 @@ def info_from_task(task, task_id, db_path):
     elif task == "Segmentation2D":
         return segmentation2d_info(task, task_id, db_path)
     elif task == "SegmentedPointCloud":
-        return segmented_pointcloud_info(task, task_id, db_path)
+        return segmented_pointcloud_info(task, task_id, db_path, fast, bounds)
     elif task == "ClusteredMesh":
-        return clustered_mesh_info(task, task_id, db_path)
+        return clustered_mesh_info(task, task_id, db_path, fast)
     else:
         return NotImplementedError
 
@@ -272,31 +335,130 @@ def list_configured_tasks(toml_conf):
     return list(toml_conf.keys())
 
 
-def main():
-    args = parsing().parse_args()
+def find_task_id(task, db_path):
+    """Find the id of the most recent run of a task in a dataset, from the fileset metadata.
+
+    Parameters
+    ----------
+    task : str
+        Name of the task.
+    db_path : str
+        Path to scan dataset.
+
+    Returns
+    -------
+    str or None
+        The task id, ``None`` if the task was not found.
+    """
+    md_path = os.path.join(db_path, 'metadata')
+    try:
+        json_list = [f for f in os.listdir(md_path) if f.startswith(f"{task}_") and f.endswith('.json')]
+    except FileNotFoundError:
+        return None
+    if json_list == []:
+        return None
+    md_json = max([os.path.join(md_path, json_f) for json_f in json_list], key=os.path.getctime)
+    return os.path.splitext(os.path.split(md_json)[-1])[0]
+
+
+def _summary_row(job):
+    """Compute the table row of a ``(task, db_path)`` job, to run in a worker process."""
+    task, db_path = job
+    row = {"scan": os.path.basename(os.path.normpath(db_path)), "task": task, "task_id": "", "status": "ok"}
+    task_id = find_task_id(task, db_path)
+    if task_id is None:
+        row["status"] = "missing"
+        return row
+    row["task_id"] = task_id
+    try:
+        row.update(get_summary(task, task_id, db_path))
+    except FileNotFoundError:
+        row["status"] = "incomplete"
+    except Exception as e:
+        row["status"] = f"error: {e}"
+    return row
+
+
+def summary_table(tasks, datasets, workers=None):
+    """Collect the summary of several tasks on several datasets, in parallel.
+
+    Parameters
+    ----------
+    tasks : list of str
+        Name of the tasks.
+    datasets : list of str
+        Path to the scan datasets.
+    workers : int, optional
+        Number of worker processes, defaults to the number of CPUs.
+
+    Returns
+    -------
+    list of dict
+        The table rows, one per dataset and task, in the order of `datasets` then `tasks`.
+    """
+    jobs = [(task, db_path) for db_path in datasets for task in tasks]
+    if workers == 1 or len(jobs) <= 1:
+        return [_summary_row(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_summary_row, jobs))
+
+
+def write_table(rows, path="-"):
+    """Write the table rows as a CSV or JSON file.
+
+    Parameters
+    ----------
+    rows : list of dict
+        The table rows.
+    path : str, optional
+        Path to the table file, the format is given by the extension ('.csv' or '.json').
+        Defaults to ``'-'``, CSV on standard output.
+    """
+    if path != "-" and os.path.splitext(path)[1] == ".json":
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+        return
+    columns = []
+    for row in rows:
+        columns += [k for k in row if k not in columns]
+    f = sys.stdout if path == "-" else open(path, 'w', newline='')
+    try:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
 
-    config = toml.load(os.path.join(args.db_path, "pipeline.toml"))
+def print_summary(task, db_path, fast=False, bounds=False, details=False):
+    """Print the summary of a task on a dataset.
+
+    The output files are only read if the summary stored in the fileset metadata is missing or outdated,
+    or if `details` is ``True``.
+    """
+    config = toml.load(os.path.join(db_path, "pipeline.toml"))
     # conf_tasks = list_configured_tasks(config)
-    print(f"# -- Summary of task {args.task}:")
+    print(f"# -- Summary of task {task}:")
     print("# - Used TOML configuration:")
     try:
-        print(config[args.task])
+        print(config[task])
     except KeyError:
-        print(f"Task '{args.task}' is not defined in the configuration file!")
+        print(f"Task '{task}' is not defined in the configuration file!")
 
     print("\n# - Generated metadata:")
-    md_path = os.path.join(args.db_path, 'metadata')
-    json_list = [f for f in os.listdir(md_path) if f.startswith(args.task) and f.endswith('.json')]
+    md_path = os.path.join(db_path, 'metadata')
+    json_list = [f for f in os.listdir(md_path) if f.startswith(task) and f.endswith('.json')]
     if json_list == []:
-        raise IOError("Could not find the JSON metadata file associated to task '{}' in dataset '{}'!".format(args.task,
-                                                                                                              args.db_path))
+        raise IOError("Could not find the JSON metadata file associated to task '{}' in dataset '{}'!".format(task,
+                                                                                                              db_path))
     elif len(json_list) == 1:
         md_json = json_list[0]
-        print("Found a JSON metadata file associated to task '{}' in dataset '{}'!".format(args.task, args.db_path))
+        print("Found a JSON metadata file associated to task '{}' in dataset '{}'!".format(task, db_path))
         md_json = os.path.join(md_path, md_json)
     else:
-        print("Found more than one JSON metadata file associated to task '{}' in dataset '{}':".format(args.task,
-                                                                                                       args.db_path))
+        print("Found more than one JSON metadata file associated to task '{}' in dataset '{}':".format(task,
+                                                                                                       db_path))
         [print(" - {}".format(json_f)) for json_f in json_list]
         md_json = max([os.path.join(md_path, json_f) for json_f in json_list], key=os.path.getctime)
         print("The most recent one is '{}'".format(os.path.split(md_json)[-1]))
@@ -307,12 +469,31 @@ def main():
     print(json.dumps(md_json, sort_keys=True, indent=2))
 
     print("\n# - Task outputs:")
+    summary = None if details else load_summary(task_id, db_path)
+    if summary is not None:
+        print("Stored summary of the task outputs, use `--details` to read the output files:")
+        print(json.dumps(summary, sort_keys=True, indent=2))
+        return
     try:
-        info_from_task(args.task, task_id, args.db_path)
+        info_from_task(task, task_id, db_path, fast, bounds)
     except FileNotFoundError as e:
         print(e)
         print("ERROR: No task output file found! Maybe it did not finish ?!")
 
 
+def main():
+    parser = parsing()
+    args = parser.parse_args()
+
+    datasets = sorted([p for p in glob.glob(args.db_path) if os.path.isdir(p)])
+    if len(datasets) == 0:
+        parser.error(f"Could not find any dataset matching '{args.db_path}'!")
+
+    if len(args.task) == 1 and len(datasets) == 1 and args.table is None:
+        print_summary(args.task[0], datasets[0], args.fast, args.bounds, args.details)
+    else:
+        write_table(summary_table(args.task, datasets, args.workers), args.table or "-")
+
+
 if __name__ == "__main__":
     main()
@@ -51,6 +51,7 @@ References
 """
 
 import argparse
+import copy
 import glob
 import os
 import shutil
@@ -59,19 +60,32 @@ import sys
 import tempfile
 import time
 from datetime import timedelta
+from functools import lru_cache
 from pathlib import Path
 
 import toml
 
 from romitask import PIPE_TOML
 from romitask import SCAN_TOML
+from romitask.cache import load_toml
+from romitask.concurrency import machine_resources
+from romitask.concurrency import repair_scan_index
+from romitask.concurrency import scan_lock
+from romitask.history import ORDER_POLICIES
+from romitask.history import RuntimeHistory
+from romitask.history import format_duration
+from romitask.history import order_scans
+from romitask.history import params_hash
+from romitask.history import scan_size
 from romitask.log import LOGLEV
 from romitask.log import configure_logger
 from romitask.log import get_logging_config
 from romitask.modules import DATA_CREATION_TASK
-from romitask.modules import MODULES
+from romitask.modules import ENTRY_POINT_GROUP
 from romitask.modules import NO_DATASET_TASK
-from romitask.modules import TASKS
+from romitask.modules import get_task_modules
+from romitask.modules import get_tasks
+from romitask.progress import ProgressMonitor
 
 LUIGI_CMD = "luigi"
 HELP_URL = "https://docs.romi-project.eu/plant_imager/tutorials/basics/"
@@ -81,12 +95,13 @@ def parsing():
     parser = argparse.ArgumentParser(
         description="Run a ROMI task on selected dataset.",
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog=f"The list of pre-defined tasks is: {', '.join(TASKS)}.\n" + \
+        epilog=f"The list of available tasks is: {', '.join(get_tasks())}.\n" + \
+               f"Other packages may register tasks with the '{ENTRY_POINT_GROUP}' entry point group.\n" + \
                f"See {HELP_URL} for a detailed help with CLI.")
 
     # Positional arguments:
     parser.add_argument('task', metavar='task', type=str,
-                        help=f"Name of the ROMI task to run. See the list of pre-defined tasks below.")
+                        help=f"Name of the ROMI task to run. See the list of available tasks below.")
     parser.add_argument('dataset_path', type=str, default='', nargs='*',
                         help="""Path to the dataset to process (directory).
                         You may use Unix pattern matching with "*" and "?" to select a list of dataset.""")
@@ -99,11 +114,18 @@ def parsing():
                         By default, search a 'pipeline.toml' file in the selected dataset directory.""")
     parser.add_argument('--module', dest='module', type=str, default=None,
                         help="""Library and module of the task.
-                        Use it if not available or different than defined in `romitask.modules.MODULES`.""")
+                        Use it if not available or different than defined in `romitask.modules.MODULES` or by entry points.""")
     parser.add_argument('--log-level', dest='log_level', type=str, default='INFO', choices=LOGLEV,
                         help="Level of message logging, defaults to 'INFO'.")
+    parser.add_argument('--order', dest='order', type=str, default='name', choices=ORDER_POLICIES,
+                        help="""Order of the datasets to process, defaults to 'name'.
+                        With 'longest' ('shortest'), the datasets with the longest (shortest) predicted runtime are
+                        processed first, from the past runs or the number of images.""")
     parser.add_argument('--dry-run', dest='dry_run', action="store_true",
                         help="Use this to test the command-line by doing everything except calling the task(s).")
+    parser.add_argument('--plan', dest='plan', action="store_true",
+                        help="""Report the complete, stale & pending tasks for each dataset, with the estimated duration
+                        of the tasks to run, without running them or writing anything to the datasets.""")
 
     # Luigi related arguments:
     luigi = parser.add_argument_group("luigi options")
@@ -111,27 +133,41 @@ def parsing():
                        help=f"Luigi command, defaults to `{LUIGI_CMD}`.")
     luigi.add_argument('--local-scheduler', dest='ls', action="store_true", default=True,
                        help="Use the local luigi scheduler, defaults to `True`.")
+    luigi.add_argument('--scheduler-url', dest='scheduler_url', type=str, default=None,
+                       help="""URL of a central luigi scheduler (`luigid`), e.g. 'http://localhost:8082/'.
+                       Replaces the local scheduler, identical tasks on the same dataset are then computed only once
+                       across all the machines and runs sharing this scheduler.""")
+    luigi.add_argument('--workers', dest='workers', type=int, default=1,
+                       help="""Number of luigi worker processes, defaults to `1`.
+                       Independent tasks of the pipeline, like two branches depending on the same upstream task,
+                       are then run concurrently on the dataset, within the cores & memory of the machine.""")
     return parser
 
 
+#: ROMI libraries to record the version of, in the backup configuration file.
+ROMI_LIBRARIES = ["dtw", "plant3dvision", "plantdb", "plantimager", "romicgal", "romiseg", "romitask"]
+
+
+@lru_cache(maxsize=None)
 def get_version():
-    """Return used ROMI libraries version."""
-    import importlib
+    """Return used ROMI libraries version.
+
+    Notes
+    -----
+    Versions are read from the installed distributions metadata, the packages are NOT imported.
+    The result is cached for the whole process as installed versions do not change during a run.
+    """
     from importlib.metadata import version
     from importlib.metadata import PackageNotFoundError
     hash_dict = {}
-    for package in ["dtw", "plant3dvision", "plantdb", "plantimager", "romicgal", "romiseg", "romitask"]:
+    for package in ROMI_LIBRARIES:
         try:
-            module = importlib.import_module(package)
-        except ModuleNotFoundError or PackageNotFoundError:
+            hash_dict[package] = version(package)
+        except PackageNotFoundError:
             hash_dict[package] = "Not Installed"
-        else:
-            try:
-                hash_dict[package] = version(package)
-            except AttributeError:
-                hash_dict[package] = "Undefined"
-            except PackageNotFoundError:
-                hash_dict[package] = "Not Installed"
+        except (AttributeError, TypeError):
+            # distribution without a 'Version' field in its metadata
+            hash_dict[package] = "Undefined"
 
     return hash_dict
 
@@ -152,7 +188,7 @@ def load_backup_scan_cfg(path):
     scan_last_cfg = os.path.join(path, SCAN_TOML)
     bak_scan_config = {}
     if os.path.isfile(scan_last_cfg):
-        bak_scan_config = toml.load(scan_last_cfg)
+        bak_scan_config = load_toml(scan_last_cfg)
 
     return bak_scan_config
 
@@ -181,7 +217,7 @@ def load_backup_pipe_cfg(path, task):
             logger.critical(f"Task '{task}' was called with dataset '{path}'!")
             logger.critical(f"It contains a processing pipeline configuration backup file!")
             sys.exit(f"Requested {task} task in non-empty folder, clean it up or change location!")
-        bak_pipe_config = toml.load(bak_pipe_path)
+        bak_pipe_config = load_toml(bak_pipe_path)
 
     return bak_pipe_config
 
@@ -218,7 +254,7 @@ def load_config_from_directory(path):
     # Read TOML configs
     for f in toml_list:
         try:
-            c = toml.load(f)
+            c = load_toml(f)
             config.update(c)  # update the config with the new one
         except:
             logger.warning(f"Could not process TOML config file: {f}")
@@ -249,7 +285,7 @@ def load_config_from_file(path):
         logger.critical(f"Could not configuration find file: '{path.absolute()}'")
     # Try to load the TOML configuration file:
     try:
-        config = toml.load(path)
+        config = load_toml(path)
     except:
         if not path.suffix == ".toml":
             logger.critical(f"Could not load TOML configuration file '{path}'!")
@@ -276,12 +312,18 @@ def get_task_module(task, module=None):
     -------
     str
         The name of the `module` to use with `task`.
+
+    Notes
+    -----
+    The manually defined module is only located, not imported, it will be imported by luigi.
     """
-    import importlib
+    from importlib.util import find_spec
     if module is not None:
         try:
-            importlib.import_module(module)
-        except ModuleNotFoundError:
+            spec = find_spec(module)
+        except (ModuleNotFoundError, ValueError):
+            spec = None
+        if spec is None:
             logger.warning(f"Could not load manually defined module: '{module}'.")
             module = get_task_predefined_module(task)
         else:
@@ -292,12 +334,13 @@ def get_task_module(task, module=None):
 
 
 def get_task_predefined_module(task: str) -> str:
-    """Try to get the task from the pre-defined ``MODULES`` dictionary."""
+    """Try to get the task from the registry of pre-defined & entry points registered tasks."""
+    task_modules = get_task_modules()
     try:
-        module = MODULES[task]
+        module = task_modules[task]
     except KeyError:
         logger.critical(f"Could not find pre-defined module for selected task '{task}'!")
-        logger.critical(f"The list of pre-defined tasks is: {', '.join(sorted(TASKS))}.")
+        logger.critical(f"The list of pre-defined tasks is: {', '.join(sorted(task_modules))}.")
         logger.critical(f"Use `--module` to manually define the Python module corresponding to the selected task.")
         sys.exit("Error with module definition!")
     else:
@@ -351,10 +394,18 @@ def create_backup_cfg(path, cfgname, config):
                          "scheduling_error": 35, "unhandled_exception": 40}
 
     # Save the libraries version:
-    config["version"] = get_version()
+    config["version"] = dict(get_version())  # copy the cached dictionary
 
-    with open(file_path, 'w') as f:
-        toml.dump(config, f)
+    cfg_str = toml.dumps(config)
+    # Skip writing an identical backup file, this avoids useless I/O on (network) file systems:
+    try:
+        with open(file_path, 'r') as f:
+            unchanged = f.read() == cfg_str
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        with open(file_path, 'w') as f:
+            f.write(cfg_str)
     return file_path
 
 
@@ -443,19 +494,19 @@ def update_config(config, update):
     return config
 
 
-def run_task(args):
-    """Load the configuration to use and call the luigi command to run the selected task.
+def load_shared_config(args):
+    """Load the PIPELINE configuration given with the `config` option, shared by all datasets.
 
     Parameters
     ----------
     args : parser.parse_args
         Parsed input arguments.
-    """
-    # - Try to load PIPELINE backup TOML configuration:
-    bak_pipe_config = load_backup_pipe_cfg(args.dataset_path, args.task)
 
-    # - Process given PIPELINE configuration directory OR file, if any:
-    config = {}
+    Returns
+    -------
+    dict or None
+        The configuration dictionary, ``None`` if no `config` option was given.
+    """
     if os.path.isdir(args.config):
         config = load_config_from_directory(args.config)
     elif os.path.isfile(args.config):
@@ -463,8 +514,38 @@ def run_task(args):
     elif args.config != "":
         logger.critical(f"Could not understand `config` option '{args.config}'!")
         sys.exit("Error with configuration file!")
+    else:
+        config = None
+    return config
+
+
+def load_dataset_config(args, shared_config=None):
+    """Load the PIPELINE configuration to use for a dataset.
+
+    Parameters
+    ----------
+    args : parser.parse_args
+        Parsed input arguments.
+    shared_config : dict, optional
+        The pre-loaded PIPELINE configuration given with the `config` option, see ``load_shared_config``.
+        If ``None`` (default), it is loaded from `args`.
+
+    Returns
+    -------
+    dict
+        The shared (or previous) configuration, updated with the local configuration files of the dataset.
+    """
+    # - Try to load PIPELINE backup TOML configuration:
+    bak_pipe_config = load_backup_pipe_cfg(args.dataset_path, args.task)
+
+    # - Process given PIPELINE configuration directory OR file, if any:
+    if shared_config is None:
+        shared_config = load_shared_config(args)
+    if shared_config is not None:
+        config = copy.deepcopy(shared_config)  # the per-dataset overlay should not leak to other datasets
     else:
         if bak_pipe_config is None:
+            config = {}
             logger.info("Using NO configuration!")
         else:
             config = bak_pipe_config
@@ -489,6 +570,36 @@ def run_task(args):
         else:
             logger.error(f"Failed to load local TOML configuration file{'s' if len(local_toml) > 1 else ''}!")
 
+    return config
+
+
+def run_task(args, shared_config=None, history=None):
+    """Load the configuration to use and call the luigi command to run the selected task.
+
+    Parameters
+    ----------
+    args : parser.parse_args
+        Parsed input arguments.
+    shared_config : dict, optional
+        The pre-loaded PIPELINE configuration given with the `config` option, see ``load_shared_config``.
+        If ``None`` (default), it is loaded from `args`.
+    history : romitask.history.RuntimeHistory, optional
+        The historical runtime database to record the run duration in.
+        If ``None`` (default), use the one of the user cache directory.
+
+    Notes
+    -----
+    When processing a list of datasets, load the `shared_config` once and only merge the per-dataset
+    local configuration overlay for each of them.
+    The `shared_config` dictionary is not modified.
+
+    The run duration is recorded only if all the tasks of the pipeline were run, and are complete after it.
+    """
+    config = load_dataset_config(args, shared_config)
+
+    # - Hash the configuration before adding the runtime sections, to compare the run with its history:
+    config_hash = params_hash(config)
+
     # - Set the name of the module to be loaded for the selected task:
     module = get_task_module(args.task, args.module)
     # - Check the dataset directory is OK to use:
@@ -504,6 +615,13 @@ def run_task(args):
 
         # - Create the "scan.toml" OR "pipeline.toml" (backup) config file used by luigi:
         file_path = create_backup_cfg(args.dataset_path, cfgname, config)
+        if args.scheduler_url is None:
+            # - Limit the resources used by concurrent tasks to the capacity of this machine, unless defined.
+            # Use a temporary config file, so the limits of this machine are not saved in the backup:
+            run_config = {**config, "resources": {**machine_resources(), **config.get("resources", {})}}
+            file_path = os.path.join(tmpd, cfgname)
+            with open(file_path, 'w') as f:
+                toml.dump(run_config, f)
         # - Define environment variables to provide the logging TOML file path to `luigi`:
         env = {"LUIGI_CONFIG_PARSER": "toml", "LUIGI_CONFIG_PATH": file_path}
         # - Define the luigi command to run:
@@ -512,24 +630,160 @@ def run_task(args):
         cmd = [args.luigicmd, "--logging-conf-file", logging_file_path,
                "--module", module, args.task,
                "--DatabaseConfig-scan", args.dataset_path]
-        if args.ls:
+        if args.scheduler_url is not None:
+            # Make the task ids unique per dataset for the central scheduler:
+            cmd += ["--scheduler-url", args.scheduler_url, "--SchedulerConfig-scan-task-ids"]
+        elif args.ls:
             cmd.append("--local-scheduler")
+        if args.workers > 1:
+            cmd += ["--workers", str(args.workers)]
 
         if args.dry_run:
             logger.info(f"Luigi command to call is:\n{cmd}")
         else:
+            # - Only a run of the whole pipeline is recorded, not a partial one:
+            full_run = runs_whole_pipeline(args, config, history)
             t_start = time.time()
             # - Start the configured pipeline:
-            p = subprocess.run(cmd, env={**os.environ, **env}, check=True)
-            delta = timedelta(seconds=time.time() - t_start)
+            try:
+                p = subprocess.run(cmd, env={**os.environ, **env}, check=True)
+            finally:
+                if args.workers > 1 and Path(args.dataset_path).is_dir():
+                    # Restore the filesets & files dropped from the scan index by concurrent workers, if any:
+                    with scan_lock(args.dataset_path):
+                        repair_scan_index(args.dataset_path)
+            duration = time.time() - t_start
+            delta = timedelta(seconds=duration)
             delta = str(delta).split('.')[0]  # to get HH:MM:SS
             if p.returncode == 0:
                 logger.info(f"Done in {delta}s!")
+                # The luigi command also exits with 0 if a task failed, check the pipeline is complete:
+                if full_run and is_pipeline_complete(args, config, history):
+                    record_run(history, args.task, duration, scan_size(args.dataset_path), config_hash)
             else:
                 logger.info(f"Failed after {delta}s!")
 
     return
 
+def plan_task(args, shared_config=None, history=None):
+    """Report the state of the tasks required to run the selected task on a dataset, without running them.
+
+    Parameters
+    ----------
+    args : parser.parse_args
+        Parsed input arguments.
+    shared_config : dict, optional
+        The pre-loaded PIPELINE configuration given with the `config` option, see ``load_shared_config``.
+    history : romitask.history.RuntimeHistory, optional
+        The historical runtime database used to estimate the duration of the tasks to run.
+
+    Returns
+    -------
+    list of dict
+        The planned tasks, see ``romitask.planner.plan``.
+
+    Notes
+    -----
+    Nothing is written to the dataset, see ``romitask.planner``.
+    """
+    from romitask.planner import format_plan
+    config = load_dataset_config(args, shared_config)
+    planned = plan_dataset(args, config, history)
+    print("\n".join(format_plan(planned)))
+    return planned
+
+
+def plan_dataset(args, config, history=None):
+    """Resolve the DAG of the selected task on a dataset with its loaded configuration, see ``romitask.planner``.
+
+    Parameters
+    ----------
+    args : parser.parse_args
+        Parsed input arguments.
+    config : dict
+        The PIPELINE configuration of the dataset, see ``load_dataset_config``.
+    history : romitask.history.RuntimeHistory, optional
+        The historical runtime database used to estimate the duration of the tasks to run.
+
+    Returns
+    -------
+    list of dict
+        The planned tasks, see ``romitask.planner.plan``.
+    """
+    import importlib
+    import luigi
+    from romitask.planner import load_luigi_config
+    from romitask.planner import plan
+    load_luigi_config(config)
+    importlib.import_module(get_task_module(args.task, args.module))
+    task = luigi.task_register.Register.get_task_cls(args.task)()
+    return plan(task, args.dataset_path, history)
+
+
+def runs_whole_pipeline(args, config, history=None):
+    """Test if running the selected task on a dataset runs all the tasks of its pipeline.
+
+    Returns ``False`` if the pipeline can not be planned, see ``plan_dataset`` for the parameters.
+    """
+    from romitask.planner import runs_all_tasks
+    try:
+        return runs_all_tasks(plan_dataset(args, config, history))
+    except Exception as e:
+        logger.debug(f"Could not plan the pipeline: {e}")
+        return False
+
+
+def is_pipeline_complete(args, config, history=None):
+    """Test if all the tasks of the pipeline of the selected task are complete on a dataset.
+
+    Returns ``False`` if the pipeline can not be planned, see ``plan_dataset`` for the parameters.
+    """
+    try:
+        return all(entry['state'] == 'complete' for entry in plan_dataset(args, config, history))
+    except Exception as e:
+        logger.debug(f"Could not plan the pipeline: {e}")
+        return False
+
+
+def record_run(history, task, duration, size, config_hash):
+    """Record the duration of a pipeline run in the historical runtime database, and flag abnormally slow runs.
+
+    Parameters
+    ----------
+    history : romitask.history.RuntimeHistory or None
+        The historical runtime database, if ``None`` use the one of the user cache directory.
+    task : str
+        Name of the task run on the dataset.
+    duration : float
+        The duration of the run, in seconds.
+    size : dict
+        The scan dataset size, see ``romitask.history.scan_size``.
+    config_hash : str
+        The hash of the pipeline configuration, see ``romitask.history.params_hash``.
+    """
+    if history is None:
+        history = RuntimeHistory()
+    predicted = history.is_slow('run', task, duration, size, config_hash)
+    if predicted is not None:
+        logger.warning(f"This run was abnormally slow, {format_duration(predicted)} expected from its history!")
+    history.add('run', task, duration, size, config_hash)
+
+
+def log_eta(eta, n_folders):
+    """Log the estimated remaining time of a batch run.
+
+    Parameters
+    ----------
+    eta : float or None
+        The predicted duration of the remaining datasets in seconds, ``None`` if unknown.
+    n_folders : int
+        The number of scan datasets remaining to process.
+    """
+    if eta is not None:
+        logger.info(f"ETA for the {n_folders} remaining dataset{'s' if n_folders > 1 else ''}: "
+                    f"{format_duration(eta)}.")
+
+
 def main():
     # - Parse the input arguments to variables:
     parser = parsing()
@@ -577,19 +831,44 @@ def main():
         logger.critical(f"Could not obtain a valid path from input dataset path: '{args.dataset_path}'!")
         sys.exit(f"Error with input dataset path for '{args.task}' module!")
 
+    # - Load the shared PIPELINE configuration once for all datasets:
+    shared_config = load_shared_config(args)
+
+    if args.plan:
+        history = RuntimeHistory()
+        for folder in (folders if isinstance(folders, list) else [folders]):
+            args.dataset_path = folder
+            logger.info(f"Planning dataset '{Path(args.dataset_path).name}':")
+            plan_task(args, shared_config, history)
+        return
+
     if isinstance(folders, list):
         dataset = [folder.name for folder in folders]
         logger.info(f"Got a list of {len(folders)} scan dataset to analyze: {', '.join(dataset)}")
-        for folder in folders:
-            args.dataset_path = folder
-            print("\n")  # to facilitate the search in the console by separating the datasets
-            logger.info(f"Processing dataset '{Path(args.dataset_path).name}'.")
-            try:
-                run_task(args)
-            except Exception as e:
-                print(e)
+        history = RuntimeHistory()
+        # - Compute the dataset sizes once, to order the datasets & predict the remaining time:
+        sizes = {folder: scan_size(folder) for folder in folders}
+        folders = order_scans(folders, args.order, history, args.task, sizes=[sizes[f] for f in folders])
+        predictions = [history.predict('run', args.task, sizes[folder]) for folder in folders]
+        eta = None if any(p is None for p in predictions) else sum(predictions)
+        # - Aggregate the progress of the tasks run on all datasets:
+        with ProgressMonitor(len(folders), eta) as monitor:
+            for n, folder in enumerate(folders):
+                args.dataset_path = folder
+                print("\n")  # to facilitate the search in the console by separating the datasets
+                logger.info(f"Processing dataset '{Path(args.dataset_path).name}'.")
+                if len(folders) > 1:
+                    log_eta(eta, len(folders) - n)
+                monitor.start_dataset(folder)
+                try:
+                    run_task(args, shared_config, history)
+                except Exception as e:
+                    print(e)
+                monitor.dataset_done()
+                if eta is not None:
+                    eta = max(eta - predictions[n], 0.)
     else:
-        run_task(args)
+        run_task(args, shared_config)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Registry of reader/writer codecs for ``plantdb`` files.
+
+A codec decodes the content of a ``plantdb.fsdb.File`` into a Python object, and encodes it back.
+They are used by ``FileByFileTask`` through its ``reader`` & ``writer`` class attributes, with their ``*_options``.
+
+The pre-defined codecs are:
+
+  - ``'npy'``: NumPy arrays, read & written directly from & to disk, reading can reuse an output buffer;
+  - ``'npz'``: dictionaries of NumPy arrays, with a choosable ZIP compression level;
+  - ``'json'``: JSON serializable objects;
+  - ``'image'``: images as NumPy arrays, requires ``imageio``, with choosable compression level or quality;
+  - ``'ply'``: point clouds, using ``plantdb.io``;
+  - ``'chunked'``: NumPy arrays in the chunked array format, read lazily as ``romitask.arrays.ChunkedArray``.
+
+Other codecs can be registered with ``register_codec``.
+
+Examples
+--------
+>>> import numpy as np
+>>> from romitask.codec import get_codec
+>>> codec = get_codec('npz', compress_level=1)
+>>> codec.ext
+'npz'
+"""
+
+import copy
+import json
+import zipfile
+
+import numpy as np
+
+#: Registry of codec classes, indexed by name:
+CODECS = {}
+
+
+def register_codec(name):
+    """Class decorator registering a ``Codec`` subclass under a given name.
+
+    Parameters
+    ----------
+    name : str
+        Name of the codec in the registry.
+    """
+
+    def decorator(cls):
+        cls.name = name
+        CODECS[name] = cls
+        return cls
+
+    return decorator
+
+
+def get_codec(codec, **kwargs):
+    """Return a codec instance.
+
+    Parameters
+    ----------
+    codec : str or Codec
+        Name of a registered codec, or a codec instance to copy.
+
+    Other Parameters
+    ----------------
+    kwargs
+        Keyword arguments passed to the codec constructor, like `compress_level`,
+        or changing the attributes of the copied codec instance.
+
+    Returns
+    -------
+    Codec
+        A new codec instance, without the state of the copied instance, like a reused read buffer.
+
+    Raises
+    ------
+    KeyError
+        If the codec name is not registered.
+    TypeError
+        If a keyword argument is not an attribute of the copied codec instance.
+    """
+    if isinstance(codec, Codec):
+        codec = copy.copy(codec)
+        for key, value in kwargs.items():
+            if not hasattr(codec, key):
+                raise TypeError(f"Unknown option '{key}' for codec '{codec.name}'.")
+            setattr(codec, key, value)
+        codec.reset()
+        return codec
+    try:
+        cls = CODECS[codec]
+    except KeyError:
+        raise KeyError(f"Unknown codec '{codec}', choose from: {', '.join(sorted(CODECS))}.") from None
+    return cls(**kwargs)
+
+
+def file_path(file, ext=None):
+    """Return the path to a ``plantdb.fsdb.File``, registering its extension first if given.
+
+    Parameters
+    ----------
+    file : plantdb.fsdb.File
+        The file to get the path of.
+    ext : str, optional
+        If set, the file name and extension are (re-)registered in the database with an empty content.
+        Use it prior to writing the file content directly to the returned path.
+
+    Returns
+    -------
+    pathlib.Path
+        The path to the file.
+    """
+    if ext is not None:
+        file.write_raw(b"", ext)
+    return file.path()
+
+
+class Codec(object):
+    """Base class of the file codecs.
+
+    Attributes
+    ----------
+    name : str
+        Name of the codec in the registry.
+    ext : str
+        Default file extension used when writing.
+    """
+    name = None
+    ext = None
+
+    def __init__(self, ext=None):
+        """Codec constructor.
+
+        Parameters
+        ----------
+        ext : str, optional
+            Change the default file extension used when writing.
+        """
+        if ext is not None:
+            self.ext = ext
+
+    def reset(self):
+        """Clear the state kept between reads or writes, if any."""
+        pass
+
+    def read(self, file):
+        """Decode the content of a file.
+
+        Parameters
+        ----------
+        file : plantdb.fsdb.File
+            The file to read.
+
+        Returns
+        -------
+        any
+            The decoded object.
+        """
+        raise NotImplementedError
+
+    def write(self, file, data):
+        """Encode an object in a file.
+
+        Parameters
+        ----------
+        file : plantdb.fsdb.File
+            The file to write.
+        data : any
+            The object to encode.
+        """
+        raise NotImplementedError
+
+
+@register_codec('npy')
+class NpyCodec(Codec):
+    """Codec for NumPy arrays stored in NPY files.
+
+    Notes
+    -----
+    Arrays are read from & written to the file path, without intermediate in-memory buffer.
+    Successive reads of arrays with the same shape & data type reuse the same output buffer if ``reuse_buffer``
+    is ``True``, in which case the returned array is overwritten by the next read.
+    Hence, do not share such a codec between threads, ``FileByFileTask`` gives a copy to each prefetched read.
+    """
+    ext = 'npy'
+
+    def __init__(self, ext=None, reuse_buffer=False, mmap_mode=None):
+        """NpyCodec constructor.
+
+        Parameters
+        ----------
+        ext : str, optional
+            Change the default file extension used when writing.
+        reuse_buffer : bool, optional
+            If ``True``, successive reads fill the same output array when possible. Defaults to ``False``.
+        mmap_mode : {None, 'r', 'c'}, optional
+            If set, return a memory-mapped array instead of reading it. Defaults to ``None``.
+        """
+        super().__init__(ext)
+        self.reuse_buffer = reuse_buffer
+        self.mmap_mode = mmap_mode
+        self._buffer = None
+
+    def reset(self):
+        self._buffer = None
+
+    def read(self, file):
+        path = file_path(file)
+        if self.mmap_mode is not None:
+            return np.load(path, mmap_mode=self.mmap_mode)
+        if not self.reuse_buffer:
+            return np.load(path)
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                return np.load(path)  # not a raw buffer, let NumPy handle (and refuse) pickled objects
+            order = 'F' if fortran_order else 'C'
+            buf = self._buffer
+            if buf is None or buf.shape != shape or buf.dtype != dtype or not buf.flags[f"{order}_CONTIGUOUS"]:
+                buf = self._buffer = np.empty(shape, dtype=dtype, order=order)
+            view = memoryview(buf.reshape(-1, order='A')).cast('B')
+            n_read = 0
+            while n_read < view.nbytes:
+                n = f.readinto(view[n_read:])
+                if not n:
+                    break
+                n_read += n
+        if n_read != view.nbytes:
+            raise ValueError(f"Truncated NPY file '{path}': read {n_read} bytes out of {view.nbytes}.")
+        return buf
+
+    def write(self, file, data):
+        # Use a file object, as `numpy.save` appends '.npy' to paths with another extension:
+        with open(file_path(file, self.ext), 'wb') as f:
+            np.save(f, np.asanyarray(data))
+
+
+@register_codec('npz')
+class NpzCodec(Codec):
+    """Codec for dictionaries of NumPy arrays stored in NPZ files.
+
+    Notes
+    -----
+    With ``compress_level=None`` the archive is not compressed and can be memory-mapped,
+    see ``romitask.arrays.memmap_npz``.
+    """
+    ext = 'npz'
+
+    def __init__(self, ext=None, compress_level=None):
+        """NpzCodec constructor.
+
+        Parameters
+        ----------
+        ext : str, optional
+            Change the default file extension used when writing.
+        compress_level : int, optional
+            ZIP compression level, from ``0`` (fast) to ``9`` (small).
+            Defaults to ``None``, no compression.
+        """
+        super().__init__(ext)
+        self.compress_level = compress_level
+
+    def read(self, file):
+        with np.load(file_path(file)) as npz:
+            return {k: npz[k] for k in npz.files}
+
+    def write(self, file, data):
+        if not isinstance(data, dict):
+            data = {'arr_0': data}
+        if self.compress_level is None:
+            compression, level = zipfile.ZIP_STORED, None
+        else:
+            compression, level = zipfile.ZIP_DEFLATED, self.compress_level
+        with zipfile.ZipFile(file_path(file, self.ext), 'w', compression=compression, compresslevel=level) as zf:
+            for name, arr in data.items():
+                with zf.open(f"{name}.npy", 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.asanyarray(arr), allow_pickle=False)
+
+
+@register_codec('json')
+class JsonCodec(Codec):
+    """Codec for JSON serializable objects."""
+    ext = 'json'
+
+    def __init__(self, ext=None, indent=None):
+        """JsonCodec constructor.
+
+        Parameters
+        ----------
+        ext : str, optional
+            Change the default file extension used when writing.
+        indent : int, optional
+            Indentation level, defaults to ``None`` for the most compact representation.
+        """
+        super().__init__(ext)
+        self.indent = indent
+
+    def read(self, file):
+        with open(file_path(file), 'r') as f:
+            return json.load(f)
+
+    def write(self, file, data):
+        with open(file_path(file, self.ext), 'w') as f:
+            json.dump(data, f, indent=self.indent)
+
+
+@register_codec('image')
+class ImageCodec(Codec):
+    """Codec for images, as NumPy arrays.
+
+    Notes
+    -----
+    Requires the ``imageio`` library.
+    """
+    ext = 'png'
+
+    def __init__(self, ext=None, compress_level=None, quality=None):
+        """ImageCodec constructor.
+
+        Parameters
+        ----------
+        ext : str, optional
+            Change the default file extension used when writing, defaults to ``'png'``.
+        compress_level : int, optional
+            PNG compression level, from ``0`` (fast) to ``9`` (small).
+        quality : int, optional
+            JPEG quality, from ``1`` to ``100``.
+        """
+        super().__init__(ext)
+        self.compress_level = compress_level
+        self.quality = quality
+
+    @staticmethod
+    def _imageio():
+        try:
+            import imageio.v2 as imageio
+        except ImportError:
+            raise ImportError("The 'image' codec requires the `imageio` library, install it first!") from None
+        return imageio
+
+    def read(self, file):
+        return self._imageio().imread(file_path(file))
+
+    def write(self, file, data):
+        kwargs = {}
+        if self.ext == 'png' and self.compress_level is not None:
+            kwargs['compress_level'] = self.compress_level
+        if self.ext in ('jpg', 'jpeg') and self.quality is not None:
+            kwargs['quality'] = self.quality
+        self._imageio().imwrite(file_path(file, self.ext), data, **kwargs)
+
+
+@register_codec('ply')
+class PlyCodec(Codec):
+    """Codec for point clouds stored in PLY files, using ``plantdb.io``."""
+    ext = 'ply'
+
+    def read(self, file):
+        from plantdb.io import read_point_cloud
+        return read_point_cloud(file)
+
+    def write(self, file, data):
+        from plantdb.io import write_point_cloud
+        write_point_cloud(file, data)
+
+
+@register_codec('chunked')
+class ChunkedCodec(Codec):
+    """Codec for NumPy arrays stored in the chunked array format.
+
+    Notes
+    -----
+    Reading returns a lazy ``romitask.arrays.ChunkedArray``, only the indexed chunks are decompressed.
+
+    See Also
+    --------
+    romitask.arrays.write_chunked
+    romitask.arrays.ChunkedArray
+    """
+    ext = 'npc'
+
+    def __init__(self, ext=None, chunks=None, compress_level=6):
+        """ChunkedCodec constructor.
+
+        Parameters
+        ----------
+        ext : str, optional
+            Change the default file extension used when writing.
+        chunks : tuple of int, optional
+            The chunk shape, defaults to about 1MB per chunk.
+        compress_level : int or None, optional
+            The per-chunk ZIP compression level, defaults to ``6``.
+        """
+        super().__init__(ext)
+        self.chunks = chunks
+        self.compress_level = compress_level
+
+    def read(self, file):
+        from romitask.arrays import ChunkedArray
+        return ChunkedArray(file_path(file))
+
+    def write(self, file, data):
+        from romitask.arrays import write_chunked
+        write_chunked(file_path(file, self.ext), data, self.chunks, self.compress_level)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Tools to safely run several ROMI tasks concurrently on the same scan dataset.
+
+With several luigi workers, tasks run in forked worker processes.
+Each of them holds its own in-memory copy of the ``plantdb`` database, and the ``FSDB`` API rewrites the whole
+scan index file (``files.json``) from this copy.
+So, a task may drop from the index the filesets, or the files, written meanwhile by a concurrent task.
+
+``repair_scan_index`` reconciles the index with the fileset directories and files on disk, and writes it atomically.
+It runs under an inter-process lock (``scan_lock``), at the task boundaries only:
+
+  - before connecting to the database, when a task starts in a worker process;
+  - once a task succeeds or fails, in a worker process;
+  - once after the luigi build.
+
+Hence, the index may miss some filesets while tasks are running, but not once they have ended.
+
+To avoid oversubscribing a machine, ``RomiTask`` subclasses declare the luigi resources they need
+(cores, memory & exclusive I/O), and the runners limit them to the capacity of the machine, see ``machine_resources``.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+#: Name of the scan index file of a ``plantdb.fsdb.FSDB`` dataset:
+SCAN_INDEX = "files.json"
+#: Name of the lock file used to serialize the scan index writes:
+SCAN_LOCK = ".romitask.lock"
+#: Name of the luigi resource for the number of CPU cores:
+CORES = "cores"
+#: Name of the luigi resource for the memory, in GB:
+MEMORY = "memory_gb"
+#: Name of the luigi resource for the exclusive access to the disk:
+IO = "io"
+
+_locks = {}  # scan path -> [thread lock, depth, locked file], the locks held by this process
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def scan_lock(scan_path):
+    """Hold an exclusive inter-process lock on a scan dataset.
+
+    Parameters
+    ----------
+    scan_path : str or pathlib.Path
+        Path to the scan dataset directory.
+
+    Notes
+    -----
+    Uses ``fcntl.flock``, the lock is released if the process dies.
+    On platforms without ``fcntl``, only the threads of this process are serialized.
+    The lock is reentrant, so a thread holding it may take it again.
+    """
+    path = os.path.abspath(scan_path)
+    with _locks_guard:
+        lock = _locks.setdefault(path, [threading.RLock(), 0, None])
+    with lock[0]:
+        lock[1] += 1
+        try:
+            if lock[1] == 1:
+                try:
+                    import fcntl
+                except ImportError:  # not a POSIX platform
+                    pass
+                else:
+                    lock[2] = open(Path(path) / SCAN_LOCK, 'a')
+                    fcntl.flock(lock[2], fcntl.LOCK_EX)
+            yield
+        finally:
+            lock[1] -= 1
+            if lock[1] == 0 and lock[2] is not None:
+                lock[2].close()  # also releases the lock
+                lock[2] = None
+
+
+def _list_files(fileset_path):
+    """Return the names of the files of a fileset directory, without the hidden ones."""
+    return sorted(name for name in os.listdir(fileset_path) if not name.startswith('.'))
+
+
+def repair_scan_index(scan_path):
+    """Reconcile the scan index file with the fileset directories and files on disk.
+
+    Parameters
+    ----------
+    scan_path : str or pathlib.Path
+        Path to the scan dataset directory.
+
+    Returns
+    -------
+    list of str
+        The ids of the filesets added to, removed from, or with files changed in the index.
+
+    Notes
+    -----
+    The filesets & files missing on disk are removed from the index, the ones missing from the index are added.
+    All the directories of the scan dataset are filesets, except the 'metadata' & hidden ones.
+    If the index file can not be read, e.g. partially written, it is rebuilt from the directories.
+    The index is written atomically. Call it under ``scan_lock``.
+    """
+    scan_path = Path(scan_path)
+    index_path = scan_path / SCAN_INDEX
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        filesets = [fs for fs in index.get("filesets", []) if isinstance(fs, dict) and "id" in fs]
+    except FileNotFoundError:
+        return []  # not a dataset
+    except (OSError, ValueError, AttributeError):
+        index, filesets = None, None
+    with os.scandir(scan_path) as it:
+        on_disk = {e.name: e.path for e in it if e.is_dir() and e.name != "metadata" and not e.name.startswith('.')}
+    repaired = []
+    reconciled = []
+    for fs in filesets or []:
+        if fs["id"] not in on_disk:
+            repaired.append(fs["id"])  # deleted fileset
+            continue
+        names = _list_files(on_disk[fs["id"]])
+        # Keep the files not written yet, without a 'file' entry:
+        files = [f for f in fs.get("files", []) if "file" not in f or f["file"] in names]
+        listed = {f["file"] for f in files if "file" in f}
+        by_id = {f["id"]: f for f in files if "file" not in f}
+        for name in names:
+            if name in listed:
+                continue
+            file_id = os.path.splitext(name)[0]
+            if file_id in by_id:
+                by_id[file_id]["file"] = name
+            else:
+                files.append({"id": file_id, "file": name})
+        if files != fs.get("files", []):
+            repaired.append(fs["id"])
+        reconciled.append({**fs, "files": files})
+    known = {fs["id"] for fs in reconciled}
+    for name in sorted(set(on_disk) - known):
+        files = [{"id": os.path.splitext(f)[0], "file": f} for f in _list_files(on_disk[name])]
+        reconciled.append({"id": name, "files": files})
+        repaired.append(name)
+    if repaired or index is None:
+        index = {**(index or {}), "filesets": reconciled}
+        tmp_path = index_path.with_name(f".{SCAN_INDEX}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, index_path)
+    return repaired
+
+
+def machine_resources():
+    """Return the luigi resource limits matching the capacity of this machine.
+
+    Returns
+    -------
+    dict
+        The number of usable CPU cores, the total memory in GB and a single exclusive I/O slot.
+
+    Examples
+    --------
+    >>> from romitask.concurrency import machine_resources
+    >>> machine_resources()
+    {'cores': 8, 'memory_gb': 31, 'io': 1}
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))  # the cores this process may use, e.g. in a container
+    except AttributeError:  # not available on all platforms
+        cores = os.cpu_count() or 1
+    resources = {CORES: cores}
+    try:
+        resources[MEMORY] = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2 ** 30
+    except (AttributeError, ValueError, OSError):  # not a POSIX platform
+        pass
+    resources[IO] = 1
+    return resources
+
+
+def clip_resources(needs, limits):
+    """Return the luigi resources to declare for a task, given the configured limits.
+
+    Parameters
+    ----------
+    needs : dict
+        The amount of each resource needed by the task.
+    limits : dict
+        The resource limits of the luigi scheduler, as defined in its ``[resources]`` configuration section.
+
+    Returns
+    -------
+    dict
+        The needed resources with a limit, clipped to it.
+
+    Notes
+    -----
+    The luigi scheduler defaults to a limit of ``1`` for unconfigured resources,
+    and never runs a task needing more than the limit, hence the filtering and clipping.
+    """
+    return {k: min(int(v), limits[k]) for k, v in needs.items() if v > 0 and k in limits}
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Historical runtime database of the ROMI tasks.
+
+The durations are stored in a JSON-lines file of the user cache directory (see ``romitask.cache``),
+one record per run, with:
+
+  - the ``scope``: ``'task'`` for a single luigi task, or ``'run'`` for a whole pipeline run on a scan dataset;
+  - the ``task`` family name;
+  - the scan ``size``: its number of images and, for tasks with PLY inputs, their number of points;
+  - a hash of the task (or pipeline configuration) ``params``;
+  - the ``duration``, in seconds.
+
+The records are used to predict the duration of the next runs, hence the ETA of batch runs,
+to flag abnormally slow runs, and to order the datasets of batch runs by predicted duration.
+The oldest records are dropped when the file exceeds ``MAX_HISTORY_SIZE``.
+
+Examples
+--------
+>>> from romitask.history import RuntimeHistory
+>>> from romitask.history import params_hash
+>>> history = RuntimeHistory()
+>>> history.add('run', 'AnglesAndInternodes', 125.3, {'images': 60}, params_hash({}))
+>>> history.predict('run', 'AnglesAndInternodes', {'images': 120}, params_hash({}))
+250.6
+"""
+
+import hashlib
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+
+from romitask.cache import get_cache_dir
+
+#: Name of the runtime history file, in the cache directory:
+HISTORY_FILE = "runtimes.jsonl"
+#: A run is flagged as slow if it lasts more than this factor times its predicted duration:
+SLOW_FACTOR = 2.
+#: Minimum number of records required to flag a run as slow:
+MIN_SAMPLES = 3
+#: Maximum size of the runtime history file in bytes, the oldest half of the records is dropped beyond:
+MAX_HISTORY_SIZE = 2 ** 22
+#: Policies to order the scan datasets of a batch run:
+ORDER_POLICIES = ('name', 'longest', 'shortest')
+
+
+def params_hash(params):
+    """Return a short hash of task parameters, or of a pipeline configuration.
+
+    Parameters
+    ----------
+    params : dict
+        JSON serializable parameters, non-serializable values are converted to strings.
+
+    Returns
+    -------
+    str
+        The hash of the parameters.
+    """
+    params_str = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(params_str.encode()).hexdigest()[:12]
+
+
+def scan_size(scan_path):
+    """Return the size of a scan dataset, as its number of images.
+
+    Parameters
+    ----------
+    scan_path : str or pathlib.Path
+        Path to the scan dataset directory.
+
+    Returns
+    -------
+    dict
+        The number of images, under the 'images' key, ``0`` if there is no 'images' fileset.
+    """
+    try:
+        with os.scandir(Path(scan_path) / "images") as it:
+            return {'images': sum(1 for _ in it)}
+    except OSError:
+        return {'images': 0}
+
+
+def format_duration(seconds):
+    """Format a duration in seconds as 'HH:MM:SS'."""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class RuntimeHistory(object):
+    """The historical runtime database of the ROMI tasks.
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        Path to the JSON-lines history file.
+    """
+
+    def __init__(self, path=None):
+        """RuntimeHistory constructor.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path, optional
+            Path to the JSON-lines history file, defaults to ``HISTORY_FILE`` in the cache directory.
+        """
+        self.path = Path(path) if path is not None else get_cache_dir() / HISTORY_FILE
+        self._records = None
+
+    def records(self, scope, task, params=None):
+        """Return the records of a task.
+
+        Parameters
+        ----------
+        scope : {'task', 'run'}
+            The scope of the records.
+        task : str
+            The task family name.
+        params : str, optional
+            If set, only return the records with this parameters hash.
+
+        Returns
+        -------
+        list of dict
+            The matching records, in chronological order.
+        """
+        if self._records is None:
+            self._records = []
+            try:
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        try:
+                            self._records.append(json.loads(line))
+                        except ValueError:
+                            continue  # partially written line
+            except OSError:
+                pass
+        return [r for r in self._records if r.get('scope') == scope and r.get('task') == task
+                and (params is None or r.get('params') == params)]
+
+    def add(self, scope, task, duration, size, params):
+        """Add a record to the history.
+
+        Parameters
+        ----------
+        scope : {'task', 'run'}
+            The scope of the record.
+        task : str
+            The task family name.
+        duration : float
+            The duration of the run, in seconds.
+        size : dict
+            The scan size, see ``scan_size``.
+        params : str
+            The parameters hash, see ``params_hash``.
+        """
+        record = {'scope': scope, 'task': task, 'params': params, 'size': size,
+                  'duration': round(duration, 3), 'time': time.time()}
+        try:
+            # A single write of a line in append mode, so concurrent writers do not mix their records:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                file_size = f.tell()
+        except OSError:
+            return
+        if self._records is not None:
+            self._records.append(record)
+        if file_size > MAX_HISTORY_SIZE:
+            self._trim()
+
+    def _trim(self):
+        """Drop the oldest half of the records from the history file."""
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.readlines()
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, 'w') as f:
+                f.writelines(lines[len(lines) // 2:])
+            os.replace(tmp_path, self.path)  # records appended meanwhile by other processes are lost
+        except OSError:
+            return
+        if self._records is not None:
+            self._records = self._records[len(self._records) // 2:]
+
+    def predict(self, scope, task, size, params=None):
+        """Predict the duration of a run from the history.
+
+        Parameters
+        ----------
+        scope : {'task', 'run'}
+            The scope of the run.
+        task : str
+            The task family name.
+        size : dict
+            The scan size, see ``scan_size``.
+        params : str, optional
+            The parameters hash, the records with the same parameters are used if any,
+            else all the records of the task.
+
+        Returns
+        -------
+        float or None
+            The predicted duration in seconds, ``None`` without history.
+
+        Notes
+        -----
+        The duration is predicted as the median duration per point times the number of points, if known,
+        else as the median duration per image times the number of images,
+        or as the median duration if the number of images is unknown.
+        """
+        records = self.records(scope, task, params) if params is not None else []
+        if not records:
+            records = self.records(scope, task)
+        if not records:
+            return None
+        n_points = size.get('points', 0)
+        rates = [r['duration'] / r['size']['points'] for r in records if r['size'].get('points', 0) > 0]
+        if n_points > 0 and rates:
+            return statistics.median(rates) * n_points
+        n_images = size.get('images', 0)
+        rates = [r['duration'] / r['size']['images'] for r in records if r['size'].get('images', 0) > 0]
+        if n_images > 0 and rates:
+            return statistics.median(rates) * n_images
+        return statistics.median(r['duration'] for r in records)
+
+    def is_slow(self, scope, task, duration, size, params=None):
+        """Test if a run is abnormally slow compared to the history.
+
+        Call it prior to adding the record of the run.
+
+        Parameters
+        ----------
+        scope : {'task', 'run'}
+            The scope of the run.
+        task : str
+            The task family name.
+        duration : float
+            The duration of the run, in seconds.
+        size : dict
+            The scan size, see ``scan_size``.
+        params : str, optional
+            The parameters hash.
+
+        Returns
+        -------
+        float or None
+            The predicted duration if the run lasted more than ``SLOW_FACTOR`` times it, else ``None``.
+            Requires at least ``MIN_SAMPLES`` records.
+        """
+        if len(self.records(scope, task)) < MIN_SAMPLES:
+            return None
+        predicted = self.predict(scope, task, size, params)
+        if predicted is not None and duration > SLOW_FACTOR * predicted:
+            return predicted
+        return None
+
+    def eta(self, scope, task, sizes, params=None):
+        """Predict the total duration of a batch of runs.
+
+        Parameters
+        ----------
+        scope : {'task', 'run'}
+            The scope of the runs.
+        task : str
+            The task family name.
+        sizes : list of dict
+            The scan size of each run, see ``scan_size``.
+        params : str, optional
+            The parameters hash.
+
+        Returns
+        -------
+        float or None
+            The predicted total duration in seconds, ``None`` without history.
+        """
+        predictions = [self.predict(scope, task, size, params) for size in sizes]
+        if not predictions or any(p is None for p in predictions):
+            return None
+        return sum(predictions)
+
+
+def order_scans(scans, policy, history, task, params=None, path=None, sizes=None):
+    """Order the scan datasets of a batch run.
+
+    Parameters
+    ----------
+    scans : list
+        The scan datasets, as paths or objects.
+    policy : {'name', 'longest', 'shortest'}
+        The ordering policy:
+
+          - ``'name'``: keep the given order;
+          - ``'longest'``: longest predicted runs first, to minimize the total wall time of parallel runs;
+          - ``'shortest'``: shortest predicted runs first, to get feedback quickly.
+
+    history : RuntimeHistory
+        The historical runtime database.
+    task : str
+        The task family name, with the ``'run'`` scope.
+    params : str, optional
+        The parameters hash.
+    path : callable, optional
+        Function returning the path of a scan dataset object, if `scans` are not paths.
+    sizes : list of dict, optional
+        The size of each scan dataset, see ``scan_size``, computed if not given.
+
+    Returns
+    -------
+    list
+        The ordered scan datasets.
+
+    Notes
+    -----
+    The runs are ordered by predicted duration, or by number of images without history for the task.
+    """
+    if policy == 'name':
+        return list(scans)
+    if policy not in ORDER_POLICIES:
+        raise ValueError(f"Unknown ordering policy '{policy}', choose from: {', '.join(ORDER_POLICIES)}.")
+    if sizes is None:
+        sizes = [scan_size(path(scan) if path is not None else scan) for scan in scans]
+    if history.records('run', task):
+        keys = [history.predict('run', task, size, params) for size in sizes]
+    else:
+        keys = [size['images'] for size in sizes]
+    order = sorted(range(len(scans)), key=keys.__getitem__, reverse=policy == 'longest')
+    return [scans[i] for i in order]
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Import-time regression check for the ``romitask`` package.
+
+It runs ``python -X importtime -c "import <module>"`` in a fresh interpreter and fails when:
+
+  - the cumulative import time of the module exceeds a budget (in milliseconds);
+  - a "heavy" module (like ``luigi`` or ``tqdm``) is imported as a side effect.
+
+Use it as follows, it exits with a non-zero code on regression:
+
+.. code-block::
+
+    python -m romitask.importtime --budget 50
+"""
+
+import argparse
+import subprocess
+import sys
+
+#: Default import time budget, in milliseconds:
+IMPORT_BUDGET_MS = 50.
+#: Modules that should never be imported by a plain ``import romitask``:
+HEAVY_MODULES = ["luigi", "tqdm", "colorlog", "toml", "numpy", "plantdb"]
+
+
+def import_times(module="romitask"):
+    """Measure the import time of a module in a fresh interpreter.
+
+    Parameters
+    ----------
+    module : str, optional
+        Name of the module to import. Defaults to ``'romitask'``.
+
+    Returns
+    -------
+    dict
+        Cumulative import time, in microseconds, indexed by imported module name.
+    """
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                       capture_output=True, text=True, check=True)
+    times = {}
+    for line in p.stderr.splitlines():
+        # Lines look like: "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            continue  # header line
+    return times
+
+
+def check_import_time(module="romitask", budget=IMPORT_BUDGET_MS, heavy_modules=None):
+    """Check the import time of a module against a budget.
+
+    Parameters
+    ----------
+    module : str, optional
+        Name of the module to import. Defaults to ``'romitask'``.
+    budget : float, optional
+        Maximum cumulative import time, in milliseconds. Defaults to ``IMPORT_BUDGET_MS``.
+    heavy_modules : list of str, optional
+        Name of the top-level modules that should not be imported.
+        Defaults to ``HEAVY_MODULES``.
+
+    Returns
+    -------
+    list of str
+        The list of detected regressions, empty if none.
+    """
+    if heavy_modules is None:
+        heavy_modules = HEAVY_MODULES
+    times = import_times(module)
+    errors = []
+    elapsed = times.get(module, 0) / 1000.
+    if elapsed > budget:
+        errors.append(f"Importing '{module}' took {elapsed:.1f}ms, above the {budget:.1f}ms budget!")
+    for heavy in heavy_modules:
+        if heavy in times:
+            errors.append(f"Importing '{module}' also imported '{heavy}'!")
+    return errors
+
+
+def parsing():
+    parser = argparse.ArgumentParser(
+        description="Check the import time of a ROMI module does not exceed a budget.")
+    parser.add_argument('--module', dest='module', type=str, default="romitask",
+                        help="Name of the module to import, defaults to 'romitask'.")
+    parser.add_argument('--budget', dest='budget', type=float, default=IMPORT_BUDGET_MS,
+                        help=f"Import time budget in milliseconds, defaults to {IMPORT_BUDGET_MS}.")
+    return parser
+
+
+def main():
+    args = parsing().parse_args()
+    errors = check_import_time(args.module, args.budget)
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(f"Import time regression for '{args.module}'!")
+    print(f"Import time of '{args.module}' is within the {args.budget}ms budget.")
+
+
+if __name__ == '__main__':
+    main()
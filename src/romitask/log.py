@@ -22,7 +22,21 @@
 # License along with romitask.  If not, see <https://www.gnu.org/licenses/>.
 # ------------------------------------------------------------------------------
 
+"""Logging utilities for romitask.
+
+The loggers configured with ``configure_logger`` put their records in a queue, emptied by a single
+``logging.handlers.QueueListener`` thread per process, so formatting & console (or file) I/O do not slow the tasks.
+Their debug messages are rate limited, as they are often emitted from per-file loops.
+Records can also be formatted as JSON-lines, for instance to be parsed by log aggregation tools.
+"""
+
+import copy
+import json
 import logging
+import os
+import queue
+import threading
+import time
 from pathlib import Path
 
 from colorlog import ColoredFormatter
@@ -72,7 +86,141 @@ def get_logging_config(name='root', log_level='INFO'):
     return LOGGING_CFG.format(name, log_level)
 
 
-def configure_logger(name, log_path="", log_level='INFO'):
+#: Name of the environment variable to format all the records as JSON-lines, if set to '1':
+LOG_JSON_ENV = "ROMITASK_LOG_JSON"
+#: Maximum number of debug messages per second and per logger, the others are dropped:
+DEBUG_RATE = 10.
+
+COLORED_FORMAT = "%(log_color)s%(levelname)-8s%(reset)s %(bg_blue)s[%(name)s]%(reset)s %(message)s"
+FILE_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(lineno)d: %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Format the records as JSON-lines, with the time, level, logger name, line number and message."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'name': record.name,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop the debug records exceeding a given rate, per logger name.
+
+    The number of dropped records is appended to the next emitted debug record.
+    """
+
+    def __init__(self, rate=DEBUG_RATE):
+        """RateLimitFilter constructor.
+
+        Parameters
+        ----------
+        rate : float
+            The maximum number of debug records per second and per logger name.
+        """
+        super().__init__()
+        self.rate = rate
+        self._buckets = {}  # logger name -> [tokens, last time, dropped records]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.rate:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(record.name, [self.rate, now, 0])
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = f"{record.getMessage()} [{dropped} debug messages dropped]"
+            record.args = None
+        return True
+
+
+class _RoutingHandler(logging.Handler):
+    """Dispatch the records dequeued by the listener to the handlers of their configured logger."""
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+
+    def handle(self, record):
+        for handler in self.routes.get(getattr(record, 'romitask_route', None), ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+class _QueueHandler(logging.Handler):
+    """Put the records of a configured logger in the queue of the current process.
+
+    As ``logging.handlers.QueueHandler``, the message is merged with its arguments & exception before queueing,
+    but without importing ``logging.handlers`` until the first record.
+    """
+
+    def __init__(self, route):
+        super().__init__()
+        self.route = route
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            record = copy.copy(record)
+            record.message = record.msg = msg
+            record.args = record.exc_info = record.exc_text = None
+            record.romitask_route = self.route
+            _process_queue().put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+_router = _RoutingHandler()
+_listener = None  # (pid, queue, listener) of the current process, as threads do not survive a fork
+_listener_lock = threading.Lock()
+
+
+def _process_queue():
+    """Return the log queue of the current process, start its listener if required."""
+    global _listener
+    if _listener is not None and _listener[0] == os.getpid():
+        return _listener[1]
+    with _listener_lock:
+        if _listener is None or _listener[0] != os.getpid():
+            from logging.handlers import QueueListener
+            from multiprocessing.util import Finalize
+            q = queue.SimpleQueue()
+            listener = QueueListener(q, _router)
+            listener.start()
+            _listener = (os.getpid(), q, listener)
+            # Flush the queue at exit, also in the `multiprocessing` processes which skip the `atexit` handlers:
+            Finalize(None, stop_listener, exitpriority=100)
+    return _listener[1]
+
+
+def stop_listener():
+    """Flush the queued records and stop the listener of the current process."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None and _listener[0] == os.getpid():
+            _listener[2].stop()
+            _listener = None
+
+
+def configure_logger(name, log_path="", log_level='INFO', json_lines=None, debug_rate=DEBUG_RATE):
     """Return a configured logger.
 
     Parameters
@@ -85,27 +233,43 @@ def configure_logger(name, log_path="", log_level='INFO'):
     log_level : {'CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'NOTSET'}
         A valid logging level.
         Defaults to `'INFO'`.
-    """
-    colored_formatter = ColoredFormatter(
-        "%(log_color)s%(levelname)-8s%(reset)s %(bg_blue)s[%(name)s]%(reset)s %(message)s",
-        datefmt=None,
-        reset=True,
-        style='%',
-    )
-    simple_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(lineno)d: %(message)s")
-
-    # create console handler:
-    console = logging.StreamHandler()
-    console.setFormatter(colored_formatter)
+    json_lines : bool, optional
+        If ``True``, format the console records as JSON-lines, see ``JsonFormatter``.
+        Defaults to ``None``, use JSON-lines if the ``ROMITASK_LOG_JSON`` environment variable is set to '1'.
+    debug_rate : float, optional
+        The maximum number of debug messages per second, the others are dropped.
+        Set it to ``0`` to disable the rate limiting.
+        Defaults to ``DEBUG_RATE``.
 
+    Notes
+    -----
+    Calling it again for the same logger does not add handlers, so records are never emitted twice.
+    Only the level is updated, and the file handler added if a new `log_path` is given.
+    """
     logger = logging.getLogger(name)
-    logger.addHandler(console)
     logger.setLevel(getattr(logging, log_level))
+    if json_lines is None:
+        json_lines = os.environ.get(LOG_JSON_ENV, "") == "1"
+
+    route = _router.routes.get(name)
+    if route is None:
+        # create console handler:
+        console = logging.StreamHandler()
+        if json_lines:
+            console.setFormatter(JsonFormatter())
+        else:
+            console.setFormatter(ColoredFormatter(COLORED_FORMAT, datefmt=None, reset=True, style='%'))
+        route = _router.routes[name] = [console]
+        queue_handler = _QueueHandler(name)
+        queue_handler.addFilter(RateLimitFilter(debug_rate))
+        logger.addHandler(queue_handler)
 
     if log_path is not None and log_path != "":
-        # create file handler:
-        fh = logging.FileHandler(Path(log_path) / f'{name}.log', mode='w')
-        fh.setFormatter(simple_formatter)
-        logger.addHandler(fh)
+        file_path = str(Path(log_path) / f'{name}.log')
+        if not any(getattr(h, 'baseFilename', None) == os.path.abspath(file_path) for h in route):
+            # create file handler:
+            fh = logging.FileHandler(file_path, mode='w')
+            fh.setFormatter(JsonFormatter() if json_lines else logging.Formatter(FILE_FORMAT))
+            route.append(fh)
 
     return logger
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Indexed queries on the file metadata of a fileset.
+
+The ``FSDB`` API stores the metadata of each file of a fileset in a JSON file, under ``<scan>/metadata/<fileset>/``.
+Filtering the files of a fileset with ``Fileset.get_files(query=...)`` opens and parses all of them.
+
+A ``MetadataIndex`` keeps a copy of the file metadata of a fileset in the user cache directory
+(see ``romitask.cache``), with the modification time & size of each metadata file.
+It is refreshed with a single ``os.scandir`` pass over the metadata directory, only reading the changed files,
+and answers equality queries from an in-memory index of the values.
+
+``metadata_table`` loads selected metadata keys of a whole fileset, like the poses, as NumPy columns.
+
+Examples
+--------
+>>> from romitask.metadata import query_files
+>>> rgb_files = query_files(fileset, {"channel": "rgb"})
+>>> from romitask.metadata import metadata_table
+>>> poses = metadata_table(fileset, ['pose'])['pose']
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import luigi
+
+from romitask.cache import dump_json_cache
+from romitask.cache import get_cache_dir
+from romitask.cache import load_json_cache
+from romitask.log import configure_logger
+
+logger = configure_logger(__name__)
+
+#: Name of the metadata index directory, in the cache directory:
+INDEX_DIR = "metadata_index"
+
+_INDEXES = {}  # metadata directory -> MetadataIndex, for the current process
+
+
+def _normalize(value):
+    """Return a JSON value with its numbers & booleans as floats, as ``1 == 1.0 == True`` in Python."""
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def _value_key(value):
+    """Return a hashable key of a JSON value, equal for values equal in Python, maybe for others."""
+    return json.dumps(_normalize(value), sort_keys=True)
+
+
+class MetadataIndex(object):
+    """The file metadata of a fileset, persisted in the cache directory.
+
+    Attributes
+    ----------
+    metadata_dir : pathlib.Path
+        Path to the directory with the file metadata JSON files of the fileset.
+    path : pathlib.Path
+        Path to the persisted index file.
+    """
+
+    def __init__(self, metadata_dir, path=None):
+        """MetadataIndex constructor.
+
+        Parameters
+        ----------
+        metadata_dir : str or pathlib.Path
+            Path to the directory with the file metadata JSON files of the fileset.
+        path : str or pathlib.Path, optional
+            Path to the persisted index file, defaults to a file of the ``INDEX_DIR`` cache directory.
+        """
+        self.metadata_dir = Path(metadata_dir).resolve()
+        if path is None:
+            index_dir = get_cache_dir() / INDEX_DIR
+            try:
+                index_dir.mkdir(exist_ok=True)
+            except OSError:
+                pass  # not persisted, see `dump_json_cache`
+            path = index_dir / f"{hashlib.sha1(str(self.metadata_dir).encode()).hexdigest()[:16]}.json"
+        self.path = Path(path)
+        self._entries = None  # file id -> [mtime_ns, size, metadata]
+        self._postings = {}  # metadata key -> {value key -> set of file ids}
+        self._tables = {}  # (file ids, keys) -> columns, see `table`
+
+    def refresh(self):
+        """Update the index with the added, modified & removed metadata files.
+
+        Returns
+        -------
+        int
+            The number of added, modified & removed metadata files.
+        """
+        if self._entries is None:
+            cached = load_json_cache(self.path)
+            self._entries = cached.get("files", {}) if cached.get("path") == str(self.metadata_dir) else {}
+        try:
+            with os.scandir(self.metadata_dir) as it:
+                stats = {os.path.splitext(e.name)[0]: (e.path, e.stat()) for e in it
+                         if e.name.endswith('.json') and e.is_file()}
+        except OSError:
+            stats = {}
+        changed = set(self._entries) - set(stats)
+        for file_id in changed:
+            del self._entries[file_id]
+        for file_id, (path, st) in stats.items():
+            entry = self._entries.get(file_id)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                continue
+            try:
+                with open(path, 'r') as f:
+                    self._entries[file_id] = [st.st_mtime_ns, st.st_size, json.load(f)]
+            except (OSError, ValueError):
+                self._entries[file_id] = [0, -1, {}]  # partially written, read again on next refresh
+            changed.add(file_id)
+        if changed:
+            self._postings = {}
+            self._tables = {}
+            dump_json_cache(self.path, {"path": str(self.metadata_dir), "files": self._entries})
+            logger.debug(f"Indexed {len(changed)} file metadata changes of '{self.metadata_dir}'.")
+        return len(changed)
+
+    def metadata(self, file_id):
+        """Return the indexed metadata of a file, an empty dictionary if it has none."""
+        if self._entries is None:
+            self.refresh()
+        entry = self._entries.get(file_id)
+        return entry[2] if entry is not None else {}
+
+    def query(self, query):
+        """Return the ids of the files whose metadata fulfill an equality query.
+
+        Parameters
+        ----------
+        query : dict
+            The filtering dictionary, all key(s) and value(s) must be found in the file metadata.
+
+        Returns
+        -------
+        set of str
+            The ids of the matching files.
+
+        Notes
+        -----
+        Call ``refresh`` first to take the latest metadata changes into account.
+        The values are compared with ``==``, as ``Fileset.get_files(query=...)`` does.
+        """
+        if self._entries is None:
+            self.refresh()
+        matching = None
+        for key, value in query.items():
+            if key not in self._postings:
+                postings = {}
+                for file_id, entry in self._entries.items():
+                    if key in entry[2]:
+                        postings.setdefault(_value_key(entry[2][key]), set()).add(file_id)
+                self._postings[key] = postings
+            ids = self._postings[key].get(_value_key(value), set())
+            matching = ids if matching is None else matching & ids
+            if not matching:
+                break
+        if matching is None:
+            return set(self._entries)
+        # Distinct values may share a key, e.g. large integers, check the candidates:
+        return {file_id for file_id in matching
+                if all(key in self._entries[file_id][2] and self._entries[file_id][2][key] == value
+                       for key, value in query.items())}
+
+    def table(self, ids, keys):
+        """Return selected metadata keys of some files as columns, cached until a metadata file changes.
+
+        Parameters
+        ----------
+        ids : list of str
+            The ids of the files, in the order of the rows.
+        keys : list of str
+            The metadata keys to load.
+
+        Returns
+        -------
+        dict
+            The file ids under ``'id'`` and one array per metadata key, see ``_column``.
+
+        Notes
+        -----
+        Call ``refresh`` first to take the latest metadata changes into account.
+        """
+        if self._entries is None:
+            self.refresh()
+        cache_key = (tuple(ids), tuple(keys))
+        if cache_key not in self._tables:
+            self._tables[cache_key] = _table(ids, [self.metadata(file_id) for file_id in ids], keys)
+        return self._tables[cache_key]
+
+
+def get_metadata_index(metadata_dir):
+    """Return the up-to-date metadata index of a fileset, shared by the current process.
+
+    Parameters
+    ----------
+    metadata_dir : str or pathlib.Path
+        Path to the directory with the file metadata JSON files of the fileset.
+
+    Returns
+    -------
+    MetadataIndex
+        The refreshed metadata index.
+    """
+    metadata_dir = Path(metadata_dir).resolve()
+    index = _INDEXES.get(metadata_dir)
+    if index is None:
+        index = _INDEXES[metadata_dir] = MetadataIndex(metadata_dir)
+    index.refresh()
+    return index
+
+
+def fileset_metadata_dir(fileset):
+    """Return the path to the file metadata directory of a ``plantdb.fsdb.Fileset``."""
+    return Path(fileset.get_scan().path()) / "metadata" / fileset.id
+
+
+def fileset_metadata_index(fileset):
+    """Return the up-to-date metadata index of a ``plantdb.fsdb.Fileset``.
+
+    Parameters
+    ----------
+    fileset : plantdb.fsdb.Fileset
+        The fileset to index the file metadata of.
+
+    Returns
+    -------
+    MetadataIndex or None
+        The refreshed metadata index, ``None`` if the fileset has no metadata directory,
+        e.g. from another database type.
+    """
+    try:
+        metadata_dir = fileset_metadata_dir(fileset)
+    except AttributeError:
+        return None
+    if not metadata_dir.is_dir():
+        return None
+    return get_metadata_index(metadata_dir)
+
+
+def query_files(fileset, query):
+    """Return the files of a fileset whose metadata fulfill an equality query, using the metadata index.
+
+    Parameters
+    ----------
+    fileset : plantdb.fsdb.Fileset
+        The fileset to filter the files of.
+    query : dict
+        The filtering dictionary, all key(s) and value(s) must be found in the file metadata.
+
+    Returns
+    -------
+    list of plantdb.fsdb.File
+        The matching files, in the fileset order.
+
+    Notes
+    -----
+    Filesets without a metadata directory, e.g. from another database type, are filtered by ``get_files``.
+    """
+    if not query:
+        return fileset.get_files()
+    index = fileset_metadata_index(fileset)
+    if index is None:
+        return fileset.get_files(query=query)
+    # Compare to JSON values, e.g. lists instead of the tuples of a `luigi.DictParameter`:
+    query = json.loads(json.dumps(luigi.freezing.recursively_unfreeze(query)))
+    matching = index.query(query)
+    return [f for f in fileset.get_files() if f.id in matching]
+
+
+def _json_type(value):
+    """Return the JSON type of a value, booleans are not numbers."""
+    if isinstance(value, bool):
+        return bool
+    if isinstance(value, (int, float)):
+        return float
+    if isinstance(value, (list, tuple)):
+        return list
+    return type(value)
+
+
+def _column(values):
+    """Convert the values of a metadata key to a NumPy array, with one row per file.
+
+    Numbers, booleans & strings give 1D arrays and lists of numbers of the same length, like poses, 2D arrays.
+    Missing numbers are set to ``NaN``, missing strings to ``''``.
+    Other values, like dictionaries, or values of different JSON types give object arrays.
+    """
+    import numpy as np
+    present = [v for v in values if v is not None]
+    arr = None
+    if present and len({_json_type(v) for v in present}) == 1:
+        try:
+            arr = np.array(present)
+        except ValueError:  # lists of different lengths
+            pass
+    if arr is None or arr.dtype.kind not in 'biufU':
+        col = np.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            col[i] = v
+        return col
+    if len(present) == len(values):
+        return arr
+    if arr.dtype.kind == 'U':
+        col = np.full((len(values),) + arr.shape[1:], '', dtype=arr.dtype)
+    else:
+        col = np.full((len(values),) + arr.shape[1:], np.nan)
+    col[[i for i, v in enumerate(values) if v is not None]] = arr
+    return col
+
+
+def _table(ids, metadata, keys):
+    """Return the file ids & selected metadata keys as columns, see ``metadata_table``."""
+    import numpy as np
+    table = {'id': np.array(ids, dtype=str)}
+    table.update({key: _column([md.get(key) for md in metadata]) for key in keys})
+    return table
+
+
+def metadata_table(fileset, keys, structured=False):
+    """Load selected file metadata of a whole fileset as columns, in one pass over the metadata index.
+
+    Parameters
+    ----------
+    fileset : plantdb.fsdb.Fileset
+        The fileset to load the file metadata of.
+    keys : list of str
+        The metadata keys to load, e.g. ``romitask.task.IMAGES_MD``.
+    structured : bool, optional
+        If ``True``, return a NumPy structured array, else (default) a dictionary of arrays.
+
+    Returns
+    -------
+    dict or numpy.ndarray
+        The file ids under ``'id'`` and one array per metadata key, with one row per file in the fileset order,
+        see ``_column`` for the conversion of the values.
+
+    Notes
+    -----
+    The tables are cached with the metadata index, until a metadata file of the fileset changes.
+    Do not modify the returned arrays.
+
+    Examples
+    --------
+    >>> from romitask.metadata import metadata_table
+    >>> table = metadata_table(images_fileset, ['pose', 'channel'])
+    >>> rgb_poses = table['pose'][table['channel'] == 'rgb']
+    >>> rgb_poses.shape
+    (60, 5)
+    """
+    import numpy as np
+    files = fileset.get_files()
+    ids = [f.id for f in files]
+    index = fileset_metadata_index(fileset)
+    if index is not None:
+        table = index.table(ids, keys)
+    else:
+        table = _table(ids, [f.get_metadata() for f in files], keys)
+    if not structured:
+        return table
+    array = np.empty(len(ids), dtype=[(key, col.dtype, col.shape[1:]) for key, col in table.items()])
+    for key, col in table.items():
+        array[key] = col
+    return array
@@ -23,6 +23,28 @@
 # <https://www.gnu.org/licenses/>.
 # ------------------------------------------------------------------------------
 
+"""Registry of the ROMI tasks and their Python module.
+
+The pre-defined tasks are listed in ``MODULES``.
+Other packages can register their tasks with the ``romitask.tasks`` entry point group,
+the name of the entry point being the name of the task and its value the module defining it.
+For example, in a ``pyproject.toml`` file:
+
+.. code-block:: toml
+
+    [project.entry-points."romitask.tasks"]
+    MyTask = "mypackage.tasks:MyTask"
+
+The registry index is cached on disk and keyed by the state of the installed distributions,
+so resolving a task name to its module does not import any plugin nor re-read all entry points.
+"""
+
+import hashlib
+import os
+import sys
+from functools import lru_cache
+from types import MappingProxyType
+
 MODULES = {
     # Scanning module:
     "Scan": "plantimager.tasks.scan",
@@ -70,6 +92,7 @@ MODULES = {
     "Clean": "romitask.task",
 }
 
+#: List of the pre-defined tasks, use ``get_tasks`` to include the entry points registered tasks.
 TASKS = list(MODULES.keys())
 
 #: List of tasks that create a dataset or that can be used without specifying an existing dataset.
@@ -87,3 +110,99 @@ NO_DATASET_TASK = [
     "DummyTask",
     "ScannerToCenter",
 ]
+
+#: Name of the entry point group used by packages to register their tasks:
+ENTRY_POINT_GROUP = "romitask.tasks"
+#: Name of the registry index cache file:
+REGISTRY_CACHE = "task_registry.json"
+
+
+def _distributions_fingerprint():
+    """Return a fingerprint of the installed distributions.
+
+    It hashes the name and modification time of all distribution metadata directories found in ``sys.path``.
+    Installing, upgrading or removing a package changes it.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the installed distributions state.
+    """
+    h = hashlib.sha1()
+    for path in sys.path:
+        try:
+            entries = sorted(os.scandir(path or "."), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.endswith((".dist-info", ".egg-info", ".egg-link", ".pth")):
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+                h.update(f"{path}/{entry.name}:{mtime};".encode())
+    return h.hexdigest()
+
+
+def _entry_point_modules():
+    """Read the task modules registered with the ``romitask.tasks`` entry point group.
+
+    Returns
+    -------
+    dict
+        The module name indexed by task name.
+    """
+    from importlib.metadata import entry_points
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:  # Python < 3.10
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    # The value may be 'module' or 'module:attr', we only need the module:
+    return {ep.name: ep.value.split(":")[0].strip() for ep in eps}
+
+
+@lru_cache(maxsize=None)
+def get_task_modules():
+    """Return the registry of tasks, merging pre-defined & entry points registered tasks.
+
+    Returns
+    -------
+    types.MappingProxyType
+        The module name indexed by task name, as a read-only mapping.
+
+    Notes
+    -----
+    Entry points registered tasks take precedence over the pre-defined ones.
+    The entry points index is cached in the user cache directory (see ``romitask.cache``),
+    it is rebuilt only when the installed distributions change.
+    The result is also cached for the whole process, hence shared by all the callers and read-only.
+    """
+    from romitask.cache import dump_json_cache
+    from romitask.cache import get_cache_dir
+    from romitask.cache import load_json_cache
+
+    key = _distributions_fingerprint()
+    try:
+        cache_path = get_cache_dir() / REGISTRY_CACHE
+    except OSError:
+        cache_path = None
+    index = load_json_cache(cache_path) if cache_path is not None else {}
+    if index.get("key") == key:
+        ep_modules = index["modules"]
+    else:
+        ep_modules = _entry_point_modules()
+        if cache_path is not None:
+            dump_json_cache(cache_path, {"key": key, "modules": ep_modules})
+    return MappingProxyType({**MODULES, **ep_modules})
+
+
+def get_tasks():
+    """Return the list of all registered task names.
+
+    Returns
+    -------
+    list of str
+        The pre-defined & entry points registered task names.
+    """
+    return list(get_task_modules().keys())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Side-effect-free planning of ROMI tasks.
+
+The planner resolves the DAG of a task on a scan dataset, and reports the state of each task:
+
+  - ``'complete'``: the output fileset exists, and is more recent than its upstream outputs;
+  - ``'stale'``: the output fileset exists, but an upstream output is more recent or not complete,
+    luigi does not run it again unless its fileset is removed;
+  - ``'pending'``: the output fileset does not exist, is empty or is staging, luigi runs the task;
+  - ``'missing'``: a required input fileset or file does not exist, the pipeline can not run.
+
+Contrary to ``RomiTask.output``, nothing is written to the database:
+the scan dataset directory is read directly, without connecting to the database.
+The estimated duration of the tasks to run comes from the historical runtime database, see ``romitask.history``.
+
+Examples
+--------
+>>> from romitask.planner import load_luigi_config
+>>> from romitask.planner import plan
+>>> from romitask.task import DummyTask
+>>> load_luigi_config({})
+>>> plan(DummyTask(), '/path/to/db/scan')
+[{'task': 'DummyTask', 'task_id': 'DummyTask__bdd6cbac09', 'fileset': 'DummyTask__bdd6cbac09', 'state': 'pending', 'estimate': None}]
+"""
+
+import os
+from pathlib import Path
+
+import luigi
+
+from romitask.history import RuntimeHistory
+from romitask.history import format_duration
+from romitask.history import params_hash
+from romitask.history import scan_size
+
+#: The states of the planned tasks:
+PLAN_STATES = ('complete', 'stale', 'pending', 'missing')
+
+
+def load_luigi_config(config):
+    """Replace the luigi configuration of the current process, as done by ``romi_run_task`` for the luigi command.
+
+    Parameters
+    ----------
+    config : dict
+        The pipeline configuration, as loaded from its TOML file.
+
+    Notes
+    -----
+    The luigi task instance cache is also cleared, so the tasks are created with the new configuration.
+    """
+    from luigi.freezing import recursively_freeze
+    os.environ["LUIGI_CONFIG_PARSER"] = "toml"
+    parser = luigi.configuration.get_config()
+    parser.data = {section: {k: recursively_freeze(v) if isinstance(v, dict) else v for k, v in content.items()}
+                   for section, content in config.items() if isinstance(content, dict)}
+    luigi.task_register.Register.clear_instance_cache()
+
+
+def output_location(task, scan_path):
+    """Return the location of the output fileset of a task, without calling its ``output`` method.
+
+    Parameters
+    ----------
+    task : romitask.task.RomiTask
+        The task to locate the output of.
+    scan_path : str or pathlib.Path
+        Path to the scan dataset directory.
+
+    Returns
+    -------
+    pathlib.Path
+        Path to the scan dataset directory of the output.
+    str
+        The output fileset id.
+    str or None
+        The output file id, for tasks checking the existence of a file.
+
+    Notes
+    -----
+    The output fileset is named after the task id, unless the task overrides ``RomiTask.output``.
+    """
+    from romitask.task import FileExists
+    from romitask.task import FilesetExists
+    scan_path = Path(scan_path)
+    if getattr(task, 'scan_id', "") != "":
+        scan_path = scan_path.parent / task.scan_id
+    if isinstance(task, FileExists):
+        return scan_path, task.fileset_id, task.file_id
+    if isinstance(task, FilesetExists):
+        return scan_path, task.fileset_id, None
+    return scan_path, task.output_fileset_id(), None
+
+
+def output_state(scan_path, fileset_id, file_id=None):
+    """Check the existence of an output fileset from the scan dataset directory.
+
+    Parameters
+    ----------
+    scan_path : str or pathlib.Path
+        Path to the scan dataset directory.
+    fileset_id : str
+        The fileset id.
+    file_id : str, optional
+        If set, check the existence of this file in the fileset.
+
+    Returns
+    -------
+    bool
+        ``True`` if the fileset (or file) exists, is not empty and is not staging.
+    float or None
+        The most recent modification time of its files, ``None`` if it does not exist.
+    """
+    from romitask.snapshot import get_snapshot
+    if file_id is None and not get_snapshot(scan_path).exists(fileset_id):
+        return False, None
+    try:
+        with os.scandir(Path(scan_path) / fileset_id) as it:
+            entries = [entry for entry in it if file_id is None or os.path.splitext(entry.name)[0] == file_id]
+    except OSError:
+        return False, None
+    if not entries:
+        return False, None
+    if file_id is not None and get_snapshot(scan_path).is_staging(fileset_id):
+        return False, None
+    return True, max(entry.stat().st_mtime for entry in entries)
+
+
+def task_dependencies(task):
+    """Return the dependencies of a task, without side effects.
+
+    Parameters
+    ----------
+    task : luigi.Task
+        The task to get the dependencies of.
+
+    Returns
+    -------
+    list of luigi.Task
+        The required tasks.
+
+    Notes
+    -----
+    ``FileByFileTask`` in streaming mode are planned without streaming,
+    as resolving it requires to check the completeness of the upstream task, which writes to the database.
+    """
+    from romitask.task import FileByFileTask
+    from romitask.task import RomiTask
+    if type(task).requires is FileByFileTask.requires:
+        return luigi.task.flatten(RomiTask.requires(task))
+    return luigi.task.flatten(task.requires())
+
+
+def plan(task, scan_path, history=None):
+    """Resolve the DAG of a task on a scan dataset, without writing to the database.
+
+    Parameters
+    ----------
+    task : luigi.Task
+        The task to plan.
+    scan_path : str or pathlib.Path
+        Path to the scan dataset directory.
+    history : romitask.history.RuntimeHistory, optional
+        The historical runtime database used to estimate the duration of the tasks to run.
+        Defaults to the one of the user cache directory.
+
+    Returns
+    -------
+    list of dict
+        The planned tasks in dependency order, upstream tasks first, with their family name under 'task',
+        their 'task_id', output 'fileset', 'state' (see ``PLAN_STATES``) and 'estimate' duration.
+        The estimate is in seconds, ``None`` if unknown or if the task does not run.
+    """
+    from romitask.task import FileExists
+    from romitask.task import FilesetExists
+    from romitask.task import RomiTask
+    from romitask.task import task_params
+    if history is None:
+        history = RuntimeHistory()
+    size = scan_size(scan_path)
+    planned = {}
+
+    def visit(t):
+        if t.task_id in planned:
+            return planned[t.task_id]
+        deps = [visit(d) for d in task_dependencies(t)]
+        entry = {'task': t.get_task_family(), 'task_id': t.task_id, 'fileset': None, 'state': None,
+                 'estimate': None}
+        if isinstance(t, RomiTask):
+            scan_dir, fileset_id, file_id = output_location(t, scan_path)
+            entry['fileset'] = fileset_id
+            exists, mtime = output_state(scan_dir, fileset_id, file_id)
+        else:
+            exists, mtime = t.complete(), None
+        if isinstance(t, (FilesetExists, FileExists)):
+            entry['state'] = 'complete' if exists else 'missing'
+        elif not exists:
+            entry['state'] = 'pending'
+        elif any(d['state'] != 'complete' or (mtime is not None and (d['_mtime'] or 0) > mtime) for d in deps):
+            entry['state'] = 'stale'
+        else:
+            entry['state'] = 'complete'
+        if entry['state'] in ('pending', 'stale'):
+            entry['estimate'] = history.predict('task', entry['task'], size,
+                                                params_hash(task_params(t)))
+        entry['_mtime'] = mtime
+        planned[t.task_id] = entry
+        return entry
+
+    visit(task)
+    return [{k: v for k, v in entry.items() if k != '_mtime'} for entry in planned.values()]
+
+
+def runs_all_tasks(planned):
+    """Test if a plan runs all the tasks of its DAG, as a full pipeline run.
+
+    Parameters
+    ----------
+    planned : list of dict
+        The planned tasks, as returned by ``plan``.
+
+    Returns
+    -------
+    bool
+        ``True`` if all the tasks are pending, except the ones checking the existence of their inputs.
+    """
+    from romitask.task import FileExists
+    from romitask.task import FilesetExists
+    get_task_cls = luigi.task_register.Register.get_task_cls
+    to_run = [entry for entry in planned if not issubclass(get_task_cls(entry['task']), (FilesetExists, FileExists))]
+    return len(to_run) > 0 and all(entry['state'] == 'pending' for entry in to_run)
+
+
+def format_plan(planned):
+    """Format the planned tasks as text lines, with the total estimated duration of the pending tasks.
+
+    Parameters
+    ----------
+    planned : list of dict
+        The planned tasks, as returned by ``plan``.
+
+    Returns
+    -------
+    list of str
+        The lines of the report.
+    """
+    width = max([len(entry['task_id']) for entry in planned] + [7])
+    lines = [f"{'task_id':<{width}}  {'state':<8}  estimate"]
+    total, unknown = 0., 0
+    for entry in planned:
+        estimate = ""
+        if entry['state'] in ('pending', 'stale'):
+            estimate = "?" if entry['estimate'] is None else format_duration(entry['estimate'])
+        if entry['state'] == 'pending':
+            if entry['estimate'] is None:
+                unknown += 1
+            else:
+                total += entry['estimate']
+        lines.append(f"{entry['task_id']:<{width}}  {entry['state']:<8}  {estimate}")
+    n_pending = sum(entry['state'] == 'pending' for entry in planned)
+    summary = f"{n_pending} task{'s' if n_pending > 1 else ''} to run"
+    if n_pending > unknown:
+        summary += f", estimated to {format_duration(total)}"
+    if unknown:
+        summary += f", {unknown} without history to estimate {'their' if unknown > 1 else 'its'} duration"
+    lines.append(summary + ".")
+    return lines
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Fast access to PLY files, using only NumPy and the standard library.
+
+The element counts are read from the PLY header, without loading the file.
+The vertex properties (coordinates, colors) are read with a structured NumPy memory-map of the vertex block,
+so only the required fields are touched.
+
+Examples
+--------
+>>> from romitask.ply import read_ply_header
+>>> from romitask.ply import ply_vertex_bounds
+>>> header = read_ply_header('/path/to/PointCloud.ply')
+>>> header.counts()
+{'vertex': 31596}
+>>> ply_vertex_bounds('/path/to/PointCloud.ply')
+(array([-49.5, -39.7, -61.2]), array([48.2, 51.1, 105.3]))
+"""
+
+import numpy as np
+
+#: PLY property types to NumPy data types:
+PLY_DTYPES = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8',
+}
+#: PLY formats to NumPy byte orders:
+PLY_FORMATS = {'ascii': '', 'binary_little_endian': '<', 'binary_big_endian': '>'}
+
+
+class PlyHeader(object):
+    """The header of a PLY file.
+
+    Attributes
+    ----------
+    format : {'ascii', 'binary_little_endian', 'binary_big_endian'}
+        The format of the data.
+    elements : list of dict
+        The elements in file order, with their 'name', 'count' & 'properties'.
+        Each property is a ``(name, type)`` tuple, or ``(name, (count_type, item_type))`` for list properties.
+    size : int
+        The size of the header, in bytes.
+    n_lines : int
+        The number of lines of the header.
+    """
+
+    def __init__(self, fmt, elements, size, n_lines):
+        self.format = fmt
+        self.elements = elements
+        self.size = size
+        self.n_lines = n_lines
+
+    def counts(self):
+        """Return the number of items per element name, e.g. ``{'vertex': 100, 'face': 196}``."""
+        return {e['name']: e['count'] for e in self.elements}
+
+    def element_dtype(self, name):
+        """Return the NumPy structured data type of a binary element, ``None`` if it has list properties."""
+        element = self._element(name)
+        byteorder = PLY_FORMATS[self.format]
+        fields = []
+        for prop_name, prop_type in element['properties']:
+            if isinstance(prop_type, tuple):
+                return None
+            fields.append((prop_name, byteorder + PLY_DTYPES[prop_type]))
+        return np.dtype(fields)
+
+    def element_offset(self, name):
+        """Return the byte offset of a binary element block, ``None`` if preceded by an element with lists."""
+        offset = self.size
+        for element in self.elements:
+            if element['name'] == name:
+                return offset
+            dtype = self.element_dtype(element['name'])
+            if dtype is None:
+                return None
+            offset += dtype.itemsize * element['count']
+        raise KeyError(f"No element '{name}' in PLY header!")
+
+    def _element(self, name):
+        for element in self.elements:
+            if element['name'] == name:
+                return element
+        raise KeyError(f"No element '{name}' in PLY header!")
+
+
+def read_ply_header(path):
+    """Read the header of a PLY file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the PLY file.
+
+    Returns
+    -------
+    PlyHeader
+        The parsed header.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid PLY file.
+    """
+    elements = []
+    fmt = None
+    n_lines = 0
+    with open(path, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            raise ValueError(f"File '{path}' is not a PLY file!")
+        n_lines += 1
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"Unexpected end of PLY header in '{path}'!")
+            n_lines += 1
+            words = line.decode('ascii', errors='replace').split()
+            if not words or words[0] in ('comment', 'obj_info'):
+                continue
+            if words[0] == 'format':
+                fmt = words[1]
+                if fmt not in PLY_FORMATS:
+                    raise ValueError(f"Unknown PLY format '{fmt}' in '{path}'!")
+            elif words[0] == 'element':
+                elements.append({'name': words[1], 'count': int(words[2]), 'properties': []})
+            elif words[0] == 'property':
+                if words[1] == 'list':
+                    elements[-1]['properties'].append((words[4], (words[2], words[3])))
+                else:
+                    elements[-1]['properties'].append((words[2], words[1]))
+            elif words[0] == 'end_header':
+                size = f.tell()
+                break
+    if fmt is None:
+        raise ValueError(f"Missing format in PLY header of '{path}'!")
+    return PlyHeader(fmt, elements, size, n_lines)
+
+
+def read_ply_vertex_fields(path, fields=('x', 'y', 'z'), header=None):
+    """Read some properties of the vertices of a PLY file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the PLY file.
+    fields : tuple of str, optional
+        Name of the vertex properties to read, defaults to the coordinates.
+    header : PlyHeader, optional
+        The already parsed header of the PLY file.
+
+    Returns
+    -------
+    numpy.ndarray
+        A ``(n_vertices, len(fields))`` array.
+        For binary files, it is built from a memory-mapped strided view of the vertex block.
+    """
+    if header is None:
+        header = read_ply_header(path)
+    element = header._element('vertex')
+    count = element['count']
+    names = [p[0] for p in element['properties']]
+    if count == 0:
+        return np.empty((0, len(fields)))
+
+    if header.format == 'ascii':
+        # Elements are stored in header order, skip the lines of the preceding elements:
+        skip = header.n_lines
+        for e in header.elements:
+            if e['name'] == 'vertex':
+                break
+            skip += e['count']
+        cols = [names.index(f) for f in fields]
+        return np.loadtxt(path, skiprows=skip, max_rows=count, usecols=cols, ndmin=2)
+
+    dtype = header.element_dtype('vertex')
+    offset = header.element_offset('vertex')
+    if dtype is None or offset is None:
+        raise ValueError(f"Can not map vertices of '{path}', list properties are not supported!")
+    vertices = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+    return np.stack([vertices[f] for f in fields], axis=-1)
+
+
+def ply_vertex_bounds(path, header=None):
+    """Return the bounding box of the vertices of a PLY file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the PLY file.
+    header : PlyHeader, optional
+        The already parsed header of the PLY file.
+
+    Returns
+    -------
+    numpy.ndarray
+        The minimum coordinates, ``None`` if there is no vertex.
+    numpy.ndarray
+        The maximum coordinates, ``None`` if there is no vertex.
+    """
+    xyz = read_ply_vertex_fields(path, ('x', 'y', 'z'), header)
+    if len(xyz) == 0:
+        return None, None
+    return xyz.min(axis=0), xyz.max(axis=0)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Aggregated progress of batch runs.
+
+A ``ProgressMonitor`` listens to a Unix datagram socket, whose path is exported in the ``ROMITASK_PROGRESS``
+environment variable, so it is inherited by the luigi processes and their workers.
+The tasks send their events with ``notify``, a no-op when no monitor is listening.
+The dataset being processed is exported in the ``ROMITASK_PROGRESS_DATASET`` environment variable,
+and sent with each event, so the events received late are counted for the right dataset.
+
+The monitor shows the number of datasets & tasks done, the files throughput and the ETA.
+It redraws a single line if the standard error is a TTY, else it logs a line periodically.
+
+Examples
+--------
+>>> from romitask.progress import ProgressMonitor
+>>> from romitask.progress import notify
+>>> with ProgressMonitor(n_datasets=2) as monitor:
+...     for dataset in ['scan_1', 'scan_2']:
+...         monitor.start_dataset(dataset)
+...         # Sent by the luigi tasks run on the dataset, in this process or a subprocess:
+...         notify('start', task='DummyTask__bdd6cbac09')
+...         notify('done', task='DummyTask__bdd6cbac09')
+...         monitor.dataset_done()
+"""
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from romitask.log import configure_logger
+
+logger = configure_logger(__name__)
+
+#: Name of the environment variable with the path to the progress socket:
+PROGRESS_ENV = "ROMITASK_PROGRESS"
+#: Name of the environment variable with the dataset being processed:
+DATASET_ENV = "ROMITASK_PROGRESS_DATASET"
+#: Interval between two progress logs when the standard error is not a TTY, in seconds:
+LOG_INTERVAL = 30.
+#: Interval between two redraws of the progress line on a TTY, in seconds:
+REDRAW_INTERVAL = 0.5
+#: Maximum waiting time to send an event to the monitor, in seconds:
+SEND_TIMEOUT = 0.5
+
+_sender = None  # (pid, socket) of the current process, as the socket is not shared with forked processes
+
+
+def enabled():
+    """Return ``True`` if a progress monitor is listening."""
+    return bool(os.environ.get(PROGRESS_ENV, ""))
+
+
+def notify(event, **kwargs):
+    """Send an event to the progress monitor, if any.
+
+    Parameters
+    ----------
+    event : {'discovered', 'present', 'start', 'done', 'failed', 'files'}
+        The event type:
+
+          - ``'discovered'``: tasks to run were scheduled, given by their ids with the `tasks` keyword;
+          - ``'present'``: an already complete task was scheduled, given by its id with the `task` keyword;
+          - ``'start'``, ``'done'`` & ``'failed'``: a task, given by its id with the `task` keyword, started,
+            succeeded or failed;
+          - ``'files'``: a number `n` of files were processed.
+
+    Other Parameters
+    ----------------
+    kwargs
+        The event data, JSON serializable.
+
+    Notes
+    -----
+    Events are lost if the monitor does not receive them within ``SEND_TIMEOUT``, the progress is only informative.
+    The dataset being processed, see ``ProgressMonitor.start_dataset``, is added to the event data.
+    """
+    global _sender
+    path = os.environ.get(PROGRESS_ENV, "")
+    if not path:
+        return
+    try:
+        if _sender is None or _sender[0] != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            # Wait for the monitor if its queue is full, but never hang the task:
+            sock.settimeout(SEND_TIMEOUT)
+            _sender = (os.getpid(), sock)
+        message = {'event': event, 'dataset': os.environ.get(DATASET_ENV, ""), **kwargs}
+        _sender[1].sendto(json.dumps(message).encode(), path)
+    except OSError:
+        pass
+
+
+class ProgressMonitor(object):
+    """Aggregated progress view of a batch run, fed by the tasks through ``notify``.
+
+    Attributes
+    ----------
+    n_datasets : int
+        The number of datasets of the batch run.
+    datasets_done : int
+        The number of processed datasets.
+    estimate : float or None
+        The initial estimation of the batch run duration, in seconds.
+    """
+
+    def __init__(self, n_datasets, estimate=None, interval=LOG_INTERVAL):
+        """ProgressMonitor constructor.
+
+        Parameters
+        ----------
+        n_datasets : int
+            The number of datasets of the batch run.
+        estimate : float, optional
+            The initial estimation of the batch run duration in seconds, e.g. from ``romitask.history``.
+            Used for the ETA until a first dataset is processed.
+        interval : float, optional
+            Interval between two progress logs when the standard error is not a TTY, in seconds.
+        """
+        self.n_datasets = n_datasets
+        self.datasets_done = 0
+        self.estimate = estimate
+        self.interval = interval
+        self._scheduled = set()
+        self._present = set()
+        self._done = set()
+        self._failed = set()
+        self._files = 0
+        self._t_start = None
+        self._tty = sys.stderr.isatty()
+        self._sock = None
+        self._tmpdir = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """Start listening to the task events, in a background thread."""
+        self._t_start = time.time()
+        if not hasattr(socket, 'AF_UNIX'):
+            logger.debug("No Unix sockets on this platform, the progress of the tasks is not available.")
+            return
+        self._tmpdir = tempfile.mkdtemp(prefix="romitask-")
+        path = os.path.join(self._tmpdir, "progress.sock")
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(path)
+        self._sock.settimeout(REDRAW_INTERVAL)
+        os.environ[PROGRESS_ENV] = path
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop listening and show the final progress."""
+        os.environ.pop(PROGRESS_ENV, None)
+        os.environ.pop(DATASET_ENV, None)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            # Count the events still queued:
+            self._sock.setblocking(False)
+            while True:
+                try:
+                    self.update(json.loads(self._sock.recv(65536)))
+                except (BlockingIOError, InterruptedError):
+                    break
+                except (OSError, ValueError):
+                    continue
+            self._sock.close()
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._thread = None
+        if self._tty:
+            sys.stderr.write('\n')
+        logger.info(self.status())
+
+    def start_dataset(self, dataset):
+        """Signal the start of the processing of a dataset, prior to running its tasks.
+
+        Parameters
+        ----------
+        dataset : str or pathlib.Path
+            The dataset path or id, sent with the events of its tasks.
+        """
+        os.environ[DATASET_ENV] = str(dataset)
+
+    def dataset_done(self):
+        """Signal the end of the processing of a dataset."""
+        self.datasets_done += 1
+
+    def update(self, message):
+        """Update the progress with a task event, see ``notify``."""
+        event = message.get('event')
+        # The same task id may be run on several datasets:
+        dataset = message.get('dataset', "")
+        key = (dataset, message.get('task'))
+        if event == 'discovered':
+            self._scheduled.update((dataset, task) for task in message['tasks'])
+        elif event == 'present':
+            self._present.add(key)
+        elif event == 'start':
+            self._scheduled.add(key)
+        elif event == 'done':
+            self._done.add(key)
+        elif event == 'failed':
+            self._failed.add(key)
+        elif event == 'files':
+            self._files += message.get('n', 1)
+
+    def eta(self):
+        """Return the estimated remaining time in seconds, ``None`` if unknown."""
+        elapsed = time.time() - self._t_start
+        if self.datasets_done > 0:
+            return elapsed / self.datasets_done * (self.n_datasets - self.datasets_done)
+        if self.estimate is not None:
+            return max(self.estimate - elapsed, 0.)
+        return None
+
+    def status(self):
+        """Return the progress as a single line."""
+        from romitask.history import format_duration
+        elapsed = time.time() - self._t_start
+        n_tasks = len(self._scheduled - self._present)
+        status = (f"datasets {self.datasets_done}/{self.n_datasets} | tasks {len(self._done)}/{n_tasks}"
+                  f"{f' ({len(self._failed)} failed)' if self._failed else ''} | "
+                  f"{self._files / elapsed if elapsed > 0 else 0.:.1f} files/s")
+        eta = self.eta()
+        if eta is not None:
+            status += f" | ETA {format_duration(eta)}"
+        return status
+
+    def _listen(self):
+        last_show = time.time()
+        while not self._stop.is_set():
+            try:
+                self.update(json.loads(self._sock.recv(65536)))
+            except socket.timeout:
+                pass
+            except (OSError, ValueError):
+                continue
+            now = time.time()
+            if self._tty and now - last_show >= REDRAW_INTERVAL:
+                sys.stderr.write(f"\r\033[K{self.status()}")
+                sys.stderr.flush()
+                last_show = now
+            elif not self._tty and now - last_show >= self.interval:
+                logger.info(self.status())
+                last_show = now
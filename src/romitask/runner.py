@@ -23,9 +23,23 @@
 # <https://www.gnu.org/licenses/>.
 # ------------------------------------------------------------------------------
 
+import time
+
 import luigi
 
+from romitask.concurrency import machine_resources
+from romitask.concurrency import repair_scan_index
+from romitask.concurrency import scan_lock
+from romitask.history import RuntimeHistory
+from romitask.history import format_duration
+from romitask.history import order_scans
+from romitask.history import params_hash
+from romitask.history import scan_size
 from romitask.log import configure_logger
+from romitask.planner import plan
+from romitask.planner import runs_all_tasks
+from romitask.progress import ProgressMonitor
+from romitask.task import build_roots
 
 logger = configure_logger(__name__)
 
@@ -39,9 +53,15 @@ class DBRunner(object):
         Target database.
     task : list of RomiTask
         The list of task to run.
+    scheduler_url : str or None
+        URL of the central luigi scheduler, ``None`` to use a local scheduler.
+    workers : int
+        Number of luigi worker processes.
+    history : romitask.history.RuntimeHistory
+        The historical runtime database, used to log the ETA & flag the abnormally slow scans.
     """
 
-    def __init__(self, db, tasks, config):
+    def __init__(self, db, tasks, config, scheduler_url=None, workers=1):
         """Class constructor.
 
         Parameters
@@ -52,12 +72,25 @@ class DBRunner(object):
             Task or list of task to run.
         config : dict
             Luigi configuration for tasks.
+        scheduler_url : str, optional
+            URL of a central luigi scheduler (``luigid``), e.g. ``'http://localhost:8082/'``.
+            Defaults to ``None``, use a local scheduler.
+        workers : int, optional
+            Number of luigi worker processes, to run independent tasks concurrently on each scan.
+            Defaults to ``1``.
         """
         if not isinstance(tasks, (list, tuple)):
             tasks = [tasks]
         self.db = db
         self.tasks = tasks
+        self.scheduler_url = scheduler_url
+        self.workers = workers
+        self.history = RuntimeHistory()
+        self._config_hash = params_hash(config)
         luigi_config = luigi.configuration.get_config()
+        if scheduler_url is None:
+            # Limit the resources used by concurrent tasks to the capacity of this machine, `config` may override it:
+            luigi_config.read_dict({'resources': machine_resources()})
         luigi_config.read_dict(config)
 
     def _run_scan_connected(self, scan):
@@ -69,13 +102,46 @@ class DBRunner(object):
             'db': self.db,
             'scan_id': scan,
         }
+        if self.scheduler_url is not None:
+            # Make the task ids unique per dataset for the central scheduler:
+            db_config['SchedulerConfig'] = {'scan_task_ids': True}
         luigi_config = luigi.configuration.get_config()
         luigi_config.read_dict(db_config)
         tasks = [t() for t in self.tasks]
-        luigi.build(tasks=tasks,
-                    local_scheduler=True)
+        # Only a run of the whole pipeline is recorded, not a partial one:
+        full_run = all(runs_all_tasks(plan(t, scan.path(), self.history)) for t in tasks)
+        t_start = time.time()
+        # Declare the root tasks of the DAG, see `FileByFileTask.streamed_upstream`:
+        with build_roots(tasks):
+            if self.scheduler_url is None:
+                success = luigi.build(tasks=tasks,
+                                      local_scheduler=True,
+                                      workers=self.workers)
+            else:
+                success = luigi.build(tasks=tasks,
+                                      local_scheduler=False,
+                                      scheduler_url=self.scheduler_url,
+                                      workers=self.workers)
+        if success and full_run:
+            self._record_run(scan, time.time() - t_start)
+        if self.workers > 1:
+            # Restore the filesets & files dropped from the scan index by concurrent workers, if any:
+            with scan_lock(scan.path()):
+                repair_scan_index(scan.path())
         return
 
+    def _runs_name(self):
+        """Name of the run in the historical runtime database, from the task families."""
+        return '+'.join(t.get_task_family() for t in self.tasks)
+
+    def _record_run(self, scan, duration):
+        size = scan_size(scan.path())
+        predicted = self.history.is_slow('run', self._runs_name(), duration, size, self._config_hash)
+        if predicted is not None:
+            logger.warning(f"Scan '{scan.id}' was abnormally slow to process: it took {format_duration(duration)}, "
+                           f"{format_duration(predicted)} expected from its history!")
+        self.history.add('run', self._runs_name(), duration, size, self._config_hash)
+
     def run_scan(self, scan_id):
         """Run the task(s) on a single scan.
 
@@ -90,12 +156,35 @@ class DBRunner(object):
         self.db.disconnect()
         return
 
-    def run(self):
-        """Run the task(s) on all scans in the DB."""
+    def run(self, order='name'):
+        """Run the task(s) on all scans in the DB.
+
+        Parameters
+        ----------
+        order : {'name', 'longest', 'shortest'}, optional
+            The order of the scans to process, see ``romitask.history.order_scans``.
+            Defaults to ``'name'``, in the database order.
+        """
         self.db.connect()
-        for scan in self.db.get_scans():
-            logger.info(f"scan = {scan.id}")
-            self._run_scan_connected(scan)
+        scans = self.db.get_scans()
+        # Compute the scan sizes once, to order the scans & predict the remaining time:
+        sizes = {scan.id: scan_size(scan.path()) for scan in scans}
+        scans = order_scans(scans, order, self.history, self._runs_name(), self._config_hash,
+                            sizes=[sizes[scan.id] for scan in scans])
+        predictions = [self.history.predict('run', self._runs_name(), sizes[scan.id], self._config_hash)
+                       for scan in scans]
+        eta = None if any(p is None for p in predictions) else sum(predictions)
+        # Aggregate the progress of the tasks run on all scans:
+        with ProgressMonitor(len(scans), eta) as monitor:
+            for n, scan in enumerate(scans):
+                logger.info(f"scan = {scan.id}")
+                if eta is not None:
+                    logger.info(f"ETA for the {len(scans) - n} remaining scans: {format_duration(eta)}.")
+                monitor.start_dataset(scan.id)
+                self._run_scan_connected(scan)
+                monitor.dataset_done()
+                if eta is not None:
+                    eta = max(eta - predictions[n], 0.)
         logger.info("Done")
         self.db.disconnect()
         return
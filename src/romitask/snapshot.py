@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Bulk completeness checks of the task outputs of a scan dataset.
+
+A ``ScanSnapshot`` lists the filesets of a scan dataset and their number of files from a single read of its index
+file (``files.json``), or a single ``os.scandir`` pass over the dataset directory if there is no index.
+It answers the completeness of all the task outputs of the dataset, see ``RomiTask.complete``.
+
+The snapshots are cached per scan dataset by ``get_snapshot``, and invalidated when the index file changes.
+
+Examples
+--------
+>>> from romitask.snapshot import get_snapshot
+>>> snapshot = get_snapshot('/path/to/db/scan')
+>>> snapshot.n_files('images')
+60
+>>> snapshot.complete(['images', 'Colmap__feature_extrac_False_9a7a3e1d4e'])
+{'images': True, 'Colmap__feature_extrac_False_9a7a3e1d4e': False}
+"""
+
+import json
+import os
+from pathlib import Path
+
+from romitask.concurrency import SCAN_INDEX
+
+_SNAPSHOTS = {}  # scan path -> (index file stat key, snapshot)
+
+
+class ScanSnapshot(object):
+    """The filesets of a scan dataset with their number of files.
+
+    Attributes
+    ----------
+    scan_path : pathlib.Path
+        Path to the scan dataset directory.
+    filesets : dict
+        Number of files per fileset id.
+    """
+
+    def __init__(self, scan_path):
+        """ScanSnapshot constructor.
+
+        Parameters
+        ----------
+        scan_path : str or pathlib.Path
+            Path to the scan dataset directory.
+        """
+        self.scan_path = Path(scan_path)
+        self.filesets = {}
+        try:
+            with open(self.scan_path / SCAN_INDEX, 'r') as f:
+                index = json.load(f)
+            self.filesets = {fs["id"]: len(fs.get("files", [])) for fs in index.get("filesets", [])}
+        except (OSError, ValueError, KeyError):
+            self._scan_directories()
+
+    def _scan_directories(self):
+        try:
+            with os.scandir(self.scan_path) as it:
+                dirs = [e.path for e in it if e.is_dir() and e.name != "metadata" and not e.name.startswith('.')]
+        except OSError:
+            return
+        for path in dirs:
+            with os.scandir(path) as it:
+                self.filesets[os.path.basename(path)] = sum(1 for _ in it)
+
+    def n_files(self, fileset_id):
+        """Return the number of files of a fileset, ``0`` if it does not exist."""
+        return self.filesets.get(fileset_id, 0)
+
+    def is_staging(self, fileset_id):
+        """Return ``True`` if a fileset is marked as staging, see ``romitask.task.STAGING_MD``.
+
+        Notes
+        -----
+        The marker is read from the fileset metadata file at each call, as it changes without changing the index.
+        """
+        from romitask.task import STAGING_MD
+        try:
+            with open(self.scan_path / "metadata" / f"{fileset_id}.json", 'r') as f:
+                return bool(json.load(f).get(STAGING_MD, False))
+        except (OSError, ValueError, AttributeError):
+            return False
+
+    def exists(self, fileset_id):
+        """Return ``True`` if a fileset exists, is not empty and is not staging, as ``FilesetTarget.exists``.
+
+        Notes
+        -----
+        The filesets missing or empty in the index are looked for on disk,
+        as concurrent worker processes may drop them from the index, see ``romitask.concurrency``.
+        """
+        n_files = self.n_files(fileset_id)
+        if n_files == 0:
+            try:
+                with os.scandir(self.scan_path / fileset_id) as it:
+                    n_files = sum(1 for e in it if not e.name.startswith('.'))
+            except OSError:
+                return False
+        return n_files > 0 and not self.is_staging(fileset_id)
+
+    def complete(self, fileset_ids):
+        """Return the completeness of several task outputs.
+
+        Parameters
+        ----------
+        fileset_ids : list of str
+            The ids of the output filesets.
+
+        Returns
+        -------
+        dict
+            The completeness of each output fileset, indexed by id.
+        """
+        return {fileset_id: self.exists(fileset_id) for fileset_id in fileset_ids}
+
+
+def get_snapshot(scan_path):
+    """Return the snapshot of a scan dataset, taken again only if its index file changed.
+
+    Parameters
+    ----------
+    scan_path : str or pathlib.Path
+        Path to the scan dataset directory.
+
+    Returns
+    -------
+    ScanSnapshot
+        The snapshot of the scan dataset.
+    """
+    scan_path = os.path.abspath(scan_path)
+    try:
+        stat = os.stat(os.path.join(scan_path, SCAN_INDEX))
+        key = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        key = None  # no index, always scan the directories
+    cached = _SNAPSHOTS.get(scan_path)
+    if key is not None and cached is not None and cached[0] == key:
+        return cached[1]
+    snapshot = ScanSnapshot(scan_path)
+    _SNAPSHOTS[scan_path] = (key, snapshot)
+    return snapshot
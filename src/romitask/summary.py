@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# romitask - Task handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of romitask.
+#
+# romitask is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# romitask is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with romitask.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""Summary of the task outputs.
+
+A compact summary of the outputs of a task is computed with ``task_summary`` when a ``RomiTask`` succeeds.
+It is stored in the output fileset metadata, under a ``'summary'`` entry, with the time of its computation.
+Tools like ``print_task_info`` read it back with ``load_summary``, in a single small JSON file read,
+and only recompute it when the output files are newer than the summary.
+"""
+
+import json
+import os
+import re
+import time
+
+#: Name of the fileset metadata entry holding the task summary:
+SUMMARY_MD = "summary"
+
+
+def get_dataset_size(db_path):
+    return len([f for f in os.listdir(os.path.join(db_path, 'images')) if os.path.splitext(f)[1] in ['.jpg', '.png']])
+
+
+def json_metadata(task, task_id, db_path):
+    """ Get task metadata JSON.
+
+    Parameters
+    ----------
+    task : str
+        Name of the task.
+    task_id : str
+        Id of the tasks.
+    db_path : str
+        Path to scan dataset.
+
+    Returns
+    -------
+    str
+        JSON location.
+    dict
+        Loaded JSON dictionary
+
+    """
+    json_f = os.path.join(db_path, task_id, f"{task}.json")
+    return json_f, json.load(open(json_f, 'r'))
+
+
+def _count_files(out_dir, exts):
+    return len([f for f in os.listdir(out_dir) if os.path.splitext(f)[1] in exts])
+
+
+def task_summary(task, task_id, db_path):
+    """Compute the summary metrics of a task output.
+
+    Parameters
+    ----------
+    task : str
+        Name of the task.
+    task_id : str
+        Id of the tasks.
+    db_path : str
+        Path to scan dataset.
+
+    Returns
+    -------
+    dict
+        The metrics, indexed by name.
+
+    Notes
+    -----
+    PLY files are never loaded, counts are read from their header.
+    """
+    from romitask.ply import read_ply_header
+    out_dir = os.path.join(db_path, task_id)
+    summary = {"n_files": len(os.listdir(out_dir))}
+    if task in ("PointCloud", "SegmentedPointCloud"):
+        counts = read_ply_header(os.path.join(out_dir, f"{task}.ply")).counts()
+        summary["n_points"] = counts.get("vertex", 0)
+    elif task == "TriangleMesh":
+        counts = read_ply_header(os.path.join(out_dir, f"{task}.ply")).counts()
+        summary["n_vertices"] = counts.get("vertex", 0)
+        summary["n_triangles"] = counts.get("face", 0)
+    elif task == "ClusteredMesh":
+        organs = {}
+        for ply in [f for f in os.listdir(out_dir) if f.endswith('.ply')]:
+            if read_ply_header(os.path.join(out_dir, ply)).counts().get("vertex", 0) == 0:
+                continue  # don't count empty PLY as valid organs!
+            organ = ply.split('_')[0]
+            organs[organ] = organs.get(organ, 0) + 1
+        summary["n_organs"] = sum(organs.values())
+        summary.update({f"n_{organ}": n for organ, n in organs.items()})
+    elif task == "Segmentation2D":
+        organs = {}
+        for png in [f for f in os.listdir(out_dir) if f.endswith('.png')]:
+            organ = os.path.splitext(png.split('_')[1])[0]
+            organs[organ] = organs.get(organ, 0) + 1
+        summary["n_images"] = get_dataset_size(db_path)
+        summary.update({f"n_{organ}_masks": n for organ, n in organs.items()})
+    elif task in ("Masks", "Undistorted"):
+        summary["n_images"] = _count_files(out_dir, ['.jpg', '.png'])
+    elif task == "Colmap":
+        summary.update(colmap_keypoints_stats(os.path.join(out_dir, "images.json")))
+    elif task == "CurveSkeleton":
+        _, md_json = json_metadata(task, task_id, db_path)
+        summary["n_points"] = len(md_json["points"])
+    elif task == "AnglesAndInternodes":
+        _, md_json = json_metadata(task, task_id, db_path)
+        for md_info in ["angles", "internodes"]:
+            data = md_json.get(md_info, [])
+            summary[f"n_{md_info}"] = len(data)
+            if data:
+                summary[f"mean_{md_info}"] = round(sum(data) / len(data), 2)
+    return summary
+
+
+#: Matches JSON whitespaces:
+_WS = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_items(path, chunk_size=2 ** 20):
+    """Iterate over the items of a JSON file holding an object, reading it incrementally.
+
+    Parameters
+    ----------
+    path : str
+        Path to the JSON file, its top-level value must be an object.
+    chunk_size : int, optional
+        Number of characters read at once, defaults to 1M.
+
+    Yields
+    ------
+    str
+        The key of an item of the top-level object.
+    any
+        The decoded value of this item.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid JSON object.
+
+    Notes
+    -----
+    Only one item of the top-level object is decoded at once, so the memory usage does not depend on the number
+    of items, only on the size of the largest one.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf = ''
+        while True:
+            chunk = f.read(chunk_size)
+            eof = len(chunk) == 0
+            buf = buf.lstrip(' \t\n\r') + chunk
+            pos = _WS.match(buf, 0).end()
+            if pos < len(buf) or eof:
+                break
+        if pos >= len(buf) or buf[pos] != '{':
+            raise ValueError(f"File '{path}' does not hold a JSON object!")
+        pos += 1
+        while True:
+            try:
+                # Parse a whole `"key": value` item, with its following separator, from the buffer:
+                i = _WS.match(buf, pos).end()
+                if buf[i] == '}':
+                    return
+                if buf[i] == ',':
+                    i = _WS.match(buf, i + 1).end()
+                key, i = decoder.raw_decode(buf, i)
+                i = _WS.match(buf, i).end()
+                if buf[i] != ':':
+                    raise ValueError(f"Expected ':' after key '{key}' in '{path}'!")
+                value, i = decoder.raw_decode(buf, _WS.match(buf, i + 1).end())
+                # A value at the end of the buffer may be truncated (e.g. a number), check the separator is there:
+                i = _WS.match(buf, i).end()
+                if buf[i] not in ',}':
+                    raise ValueError(f"Expected ',' or '}}' after the value of '{key}' in '{path}'!")
+            except (IndexError, json.JSONDecodeError):
+                if eof:
+                    raise ValueError(f"Unexpected end of JSON object in '{path}'!") from None
+                # Need more data, keep the current item in the buffer:
+                chunk = f.read(chunk_size)
+                eof = len(chunk) == 0
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield key, value
+            pos = i
+
+
+def colmap_keypoints_stats(images_json):
+    """Compute the statistics of the number of 2D keypoints per image from a COLMAP 'images.json' file.
+
+    Parameters
+    ----------
+    images_json : str
+        Path to the COLMAP 'images.json' file.
+
+    Returns
+    -------
+    dict
+        The number of images, and the min, mean & max number of keypoints per image.
+
+    Notes
+    -----
+    The file is read incrementally, one image at a time, see ``iter_json_items``.
+    """
+    n_images, n_sum, n_min, n_max = 0, 0, None, None
+    for _, img_json in iter_json_items(images_json):
+        n = len(img_json["xys"])
+        n_images += 1
+        n_sum += n
+        n_min = n if n_min is None else min(n_min, n)
+        n_max = n if n_max is None else max(n_max, n)
+    stats = {"n_images": n_images}
+    if n_images > 0:
+        stats.update({"min_keypoints": n_min, "mean_keypoints": round(n_sum / n_images, 2), "max_keypoints": n_max})
+    return stats
+
+
+def outputs_mtime(out_dir):
+    """Return the most recent modification time of a task output directory and its files.
+
+    Parameters
+    ----------
+    out_dir : str
+        Path to the task output directory.
+
+    Returns
+    -------
+    float
+        The most recent modification time, in seconds since the epoch.
+    """
+    mtime = os.stat(out_dir).st_mtime
+    with os.scandir(out_dir) as it:
+        for entry in it:
+            mtime = max(mtime, entry.stat().st_mtime)
+    return mtime
+
+
+def make_summary(task, task_id, db_path):
+    """Compute the summary of a task output, timestamped to be stored as fileset metadata.
+
+    Parameters
+    ----------
+    task : str
+        Name of the task.
+    task_id : str
+        Id of the tasks.
+    db_path : str
+        Path to scan dataset.
+
+    Returns
+    -------
+    dict
+        The metrics indexed by name, with the time of computation under a ``'computed'`` entry.
+    """
+    computed = time.time()  # before reading the outputs, to be conservative
+    return {"computed": computed, **task_summary(task, task_id, db_path)}
+
+
+def load_summary(task_id, db_path):
+    """Load the summary of a task output stored in its fileset metadata, if up-to-date.
+
+    Parameters
+    ----------
+    task_id : str
+        Id of the tasks.
+    db_path : str
+        Path to scan dataset.
+
+    Returns
+    -------
+    dict or None
+        The metrics indexed by name, ``None`` if missing or older than the output files.
+    """
+    try:
+        with open(os.path.join(db_path, 'metadata', f"{task_id}.json"), 'r') as f:
+            summary = json.load(f).get(SUMMARY_MD)
+    except (OSError, ValueError, AttributeError):
+        return None
+    if not isinstance(summary, dict) or "computed" not in summary:
+        return None
+    try:
+        if outputs_mtime(os.path.join(db_path, task_id)) > summary["computed"]:
+            return None
+    except FileNotFoundError:
+        return None
+    return {k: v for k, v in summary.items() if k != "computed"}
+
+
+def get_summary(task, task_id, db_path):
+    """Return the summary of a task output, from the fileset metadata if up-to-date, else computed.
+
+    Parameters
+    ----------
+    task : str
+        Name of the task.
+    task_id : str
+        Id of the tasks.
+    db_path : str
+        Path to scan dataset.
+
+    Returns
+    -------
+    dict
+        The metrics indexed by name.
+    """
+    summary = load_summary(task_id, db_path)
+    if summary is None:
+        summary = task_summary(task, task_id, db_path)
+    return summary
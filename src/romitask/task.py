@@ -37,7 +37,14 @@ To check for a task completeness, the fileset existence is checked as well as al
 
 import glob
 import json
+import math
 import os.path
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from json import JSONDecodeError
 from pathlib import Path
 from shutil import rmtree
@@ -45,10 +52,33 @@ from shutil import rmtree
 import luigi
 from tqdm import tqdm
 
+from romitask import progress
+from romitask.concurrency import CORES
+from romitask.concurrency import IO
+from romitask.concurrency import MEMORY
+from romitask.concurrency import clip_resources
+from romitask.concurrency import repair_scan_index
+from romitask.concurrency import scan_lock
 from romitask.log import configure_logger
+from romitask.metadata import fileset_metadata_index
+from romitask.metadata import metadata_table
+from romitask.metadata import query_files
+from romitask.snapshot import get_snapshot
 
 logger = configure_logger(__name__)
 db = None
+#: Id of the process connected to the global `db`, differs in the forked luigi worker processes:
+_db_pid = None
+#: Whether the global `db` was reconnected in a luigi worker process:
+_worker_db = False
+#: The historical runtime database of the process, see `record_runtime`:
+_history = None
+#: The root tasks of the in-process luigi build, see `build_roots`:
+_build_roots = None
+#: Whether the requirements are walked without streaming, see `count_consumers`:
+_walking_dag = False
+#: Number of consumer tasks of each task id, cached by the ids of the root tasks of the build:
+_consumers = {}
 
 
 class ScanParameter(luigi.Parameter):
@@ -85,7 +115,7 @@ class ScanParameter(luigi.Parameter):
         If the given scan dataset id does not exist, it is created.
         """
         from plantdb import FSDB
-        global db
+        global db, _db_pid
         path = scan_path.rstrip('/')
         path = path.split('/')
         # Defines the database root dir
@@ -96,6 +126,7 @@ class ScanParameter(luigi.Parameter):
         if db is None:  # TODO: cannot change DB during run...
             db = FSDB(db_path)
             db.connect()
+            _db_pid = os.getpid()
         # Get the scan dataset object or create one & return it
         scan = db.get_scan(scan_id)
         if scan is None:
@@ -145,6 +176,31 @@ class DatabaseConfig(luigi.Config):
     scan = ScanParameter()
 
 
+class SchedulerConfig(luigi.Config):
+    """Configuration of the luigi scheduler for ROMI tasks.
+
+    Attributes
+    ----------
+    scan_task_ids : bool
+        If ``True``, the scan dataset id is given to the tasks as their ``scan_key`` significant parameter,
+        so it is part of their task ids.
+        Required with a central scheduler, as the scan dataset is not a task parameter,
+        hence tasks with the same parameters on different scans would get the same id.
+        The output fileset names are not affected, see ``RomiTask.output_fileset_id``.
+        Defaults to ``False``.
+
+    Notes
+    -----
+    With a central scheduler, identical task ids are deduplicated across workers (and nodes),
+    so the same task on the same scan dataset is computed once.
+    """
+    scan_task_ids = luigi.BoolParameter(default=False)
+
+
+#: Fileset metadata entry set to ``True`` while the outputs of the task are written, until the task succeeds:
+STAGING_MD = "staging"
+
+
 class FilesetTarget(luigi.Target):
     """Subclass ``luigi.Target`` for ``Fileset`` as defined in romitask ``plantdb.fsdb.FSDB`` API.
 
@@ -226,15 +282,20 @@ class FilesetTarget(luigi.Target):
     def exists(self):
         """Assert the target ``Fileset`` exists.
 
-        A target exists if the associated fileset exists and is not empty.
+        A target exists if the associated fileset exists, is not empty and is not staging.
 
         Returns
         -------
         bool
             ``True`` if the target exists, else ``False``.
+
+        Notes
+        -----
+        The output fileset of a task is staging while the task runs, or if it was interrupted,
+        see ``STAGING_MD``.
         """
         fs = self.scan.get_fileset(self.fileset_id)
-        return fs is not None and len(fs.get_files()) > 0
+        return fs is not None and len(fs.get_files()) > 0 and not fs.get_metadata(STAGING_MD)
 
     def get(self, create=True):
         """Returns the target ``Fileset`` instance, can be created.
@@ -251,6 +312,36 @@ class FilesetTarget(luigi.Target):
         """
         return self.scan.get_fileset(self.fileset_id, create=create)
 
+    def metadata_table(self, keys=None, structured=False):
+        """Load selected file metadata of the target ``Fileset`` as columns, see ``romitask.metadata``.
+
+        Parameters
+        ----------
+        keys : list of str, optional
+            The metadata keys to load, defaults to ``IMAGES_MD``.
+        structured : bool, optional
+            If ``True``, return a NumPy structured array, else (default) a dictionary of arrays.
+
+        Returns
+        -------
+        dict or numpy.ndarray
+            The file ids under ``'id'`` and one array per metadata key, with one row per file.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the target ``Fileset`` does not exist.
+
+        Examples
+        --------
+        >>> poses = FilesetTarget(scan, 'images').metadata_table(['pose', 'channel'])
+        >>> rgb_poses = poses['pose'][poses['channel'] == 'rgb']
+        """
+        fs = self.get(create=False)
+        if fs is None:
+            raise FileNotFoundError(f"Fileset {self.fileset_id} does not exist in scan {self.scan.id}!")
+        return metadata_table(fs, IMAGES_MD if keys is None else keys, structured)
+
 
 class RomiTask(luigi.Task):
     """ROMI implementation of a ``luigi.Task``, working with the ``plantdb.db.DB`` API.
@@ -262,15 +353,91 @@ class RomiTask(luigi.Task):
     scan_id : luigi.Parameter, optional
         The dataset id (scan name) to use to get, or create, the ``FilesetTarget``.
         If unspecified (default), the current active scan will be used.
+    scan_key : luigi.Parameter, optional
+        The dataset id the task runs on, set automatically if ``SchedulerConfig.scan_task_ids`` is ``True``
+        to get distinct task ids on distinct datasets with a central scheduler.
+        It is not part of the output fileset name.
+
+    cores : int
+        Class attribute, the number of CPU cores used by the task. Defaults to ``1``.
+    memory_gb : float
+        Class attribute, the peak memory used by the task, in GB. Defaults to ``0``, not declared.
+    exclusive_io : bool
+        Class attribute, set it to ``True`` for I/O bound tasks that should not read or write concurrently.
+        Defaults to ``False``.
 
     Notes
     -----
     The task parameters are exported automatically as fileset metadata.
 
     The task name is also exported automatically as fileset metadata, under a 'task_name' entry.
+
+    The ``cores``, ``memory_gb`` & ``exclusive_io`` needs are declared as luigi resources,
+    so concurrent tasks never exceed the capacity of the machine.
+    Only the resources limited in the luigi ``[resources]`` configuration section are declared,
+    the runners set them from the machine capacity when using a local scheduler.
     """
     upstream_task = luigi.TaskParameter()
     scan_id = luigi.Parameter(default="")
+    scan_key = luigi.Parameter(default="")
+    cores = 1
+    memory_gb = 0
+    exclusive_io = False
+
+    @classmethod
+    def get_param_values(cls, params, args, kwargs):
+        """Get the parameter values, setting the ``scan_key`` from the scan dataset if required.
+
+        Notes
+        -----
+        Also used by luigi to index its instance cache, so a task on another scan is another instance.
+        """
+        values = super().get_param_values(params, args, kwargs)
+        if not SchedulerConfig().scan_task_ids:
+            return values
+        values = dict(values)
+        if values.get('scan_key', None) == "":
+            # Use the dataset id, not its path, so it does not depend on where the database is mounted:
+            values['scan_key'] = values['scan_id'] or DatabaseConfig().scan.id  # also connects to the database
+        return [(name, values[name]) for name, _ in params]
+
+    def to_str_params(self, only_significant=False, only_public=False):
+        """Convert the parameters to a dictionary of strings, without the ``scan_key`` if unset.
+
+        Notes
+        -----
+        Also used by luigi to compute the task id, so it does not change when the ``scan_key`` is unset.
+        """
+        params = super().to_str_params(only_significant, only_public)
+        if self.scan_key == "":
+            params.pop('scan_key', None)
+        return params
+
+    def output_fileset_id(self):
+        """Return the id of the output fileset, the task id computed without the ``scan_key`` parameter.
+
+        Returns
+        -------
+        str
+            The output fileset id.
+        """
+        if self.scan_key == "":
+            return self.task_id
+        params = dict(self.to_str_params(only_significant=True, only_public=True))
+        params.pop('scan_key')
+        return luigi.task.task_id_str(self.get_task_family(), params)
+
+    @property
+    def resources(self):
+        """The luigi resources needed by the task, limited to the configured ones.
+
+        Returns
+        -------
+        dict
+            The amount of each needed resource.
+        """
+        needs = {CORES: self.cores, MEMORY: math.ceil(self.memory_gb), IO: int(self.exclusive_io)}
+        return clip_resources(needs, luigi.configuration.get_config().getintdict('resources'))
 
     def requires(self):
         """Specify dependencies to other Task object.
@@ -282,7 +449,20 @@ class RomiTask(luigi.Task):
         luigi.TaskParameter
             The upstream task.
         """
-        return self.upstream_task()
+        return self.upstream()
+
+    def upstream(self):
+        """Return the upstream task instance.
+
+        Returns
+        -------
+        RomiTask
+            The instance of the upstream task, created once per task instance.
+        """
+        cached = getattr(self, '_upstream_instance', None)
+        if cached is None:
+            cached = self._upstream_instance = self.upstream_task()
+        return cached
 
     def output(self):
         """Defines the returned ``Target``, for a ``RomiTask`` it is a ``FileSetTarget``.
@@ -299,11 +479,17 @@ class RomiTask(luigi.Task):
         The task parameters are exported automatically as fileset metadata, under a 'task_params' entry.
 
         The task name is also exported automatically as fileset metadata, under a 'task_name' entry.
+
+        The target is cached, so the fileset metadata are written once per task instance and database connection.
+        As luigi also caches the task instances, resolving the DAG creates each target once.
         """
+        cached = getattr(self, '_output_target', None)
+        if cached is not None and cached[0] is db:
+            return cached[1]
         # Get the `Fileset` id from the `task_id` attribute generated by `luigi.Task`
         # Can be overriding in inheriting class as for the `Visualization` task
         # This will be used as DIRECTORY NAME!
-        fileset_id = self.task_id
+        fileset_id = self.output_fileset_id()
         if self.scan_id == "":
             t = FilesetTarget(DatabaseConfig().scan, fileset_id)
         else:
@@ -326,8 +512,59 @@ class RomiTask(luigi.Task):
         fs.set_metadata("task_params", params)
         # Save the task name as fileset metadata under "task_name":
         fs.set_metadata("task_name", self.get_task_name())
+        self._output_target = (db, t)
         return t
 
+    def complete(self):
+        """Check if the task output exists, from the snapshot of the scan dataset.
+
+        Returns
+        -------
+        bool
+            ``True`` if the output fileset exists, is not empty and is not staging.
+
+        Notes
+        -----
+        All the tasks of a scan dataset are checked from the same snapshot, without calling ``output``,
+        see ``romitask.snapshot``.
+        Tasks overriding ``output`` are checked with their target.
+        """
+        if type(self).output is not RomiTask.output:
+            return super().complete()
+        scan_path = DatabaseConfig().scan.path() if self.scan_id == "" else Path(db.basedir) / self.scan_id
+        return get_snapshot(scan_path).exists(self.output_fileset_id())
+
+    @classmethod
+    def bulk_complete(cls, parameter_tuples):
+        """Return the parameters of the complete tasks, for the luigi bulk completeness hooks.
+
+        Parameters
+        ----------
+        parameter_tuples : list
+            The parameters of the tasks, as positional arguments tuples, keyword arguments dictionaries,
+            or single values.
+
+        Returns
+        -------
+        list
+            The parameters of the complete tasks.
+
+        Notes
+        -----
+        The tasks are checked from the same snapshot of the scan dataset, see ``complete``.
+        """
+        complete = []
+        for params in parameter_tuples:
+            if isinstance(params, (list, tuple)):
+                task = cls(*params)
+            elif isinstance(params, dict):
+                task = cls(**params)
+            else:
+                task = cls(params)
+            if task.complete():
+                complete.append(params)
+        return complete
+
     def input_file(self, file_id=None):
         """Helper method to get a file from the input fileset.
 
@@ -341,7 +578,7 @@ class RomiTask(luigi.Task):
         plantdb.db.File
             The input file.
         """
-        return self.upstream_task().output_file(file_id, False)
+        return self.upstream().output_file(file_id, False)
 
     def output_file(self, file_id=None, create=True):
         """Helper method to create & get a file from the output fileset.
@@ -362,6 +599,109 @@ class RomiTask(luigi.Task):
             file_id = self.get_task_name()
         return self.output().get().get_file(file_id, create)
 
+    def input_memmap(self, file_id=None, mode='r'):
+        """Helper method to get a zero-copy memory-mapped view of an array file from the input fileset.
+
+        Parameters
+        ----------
+        file_id : str, optional
+            Name of the input file. Defaults to ``None``.
+        mode : {'r', 'c'}, optional
+            The memory-map mode, defaults to read-only ``'r'``.
+            Use ``'c'`` (copy-on-write) to modify the array in memory without changing the file.
+
+        Returns
+        -------
+        numpy.memmap or dict
+            The memory-mapped array for an NPY file, or a dictionary of arrays indexed by name for an NPZ file.
+
+        Raises
+        ------
+        ValueError
+            If the file is not an NPY or an uncompressed NPZ file.
+
+        See Also
+        --------
+        romitask.arrays.memmap_array
+        """
+        from romitask.arrays import memmap_array
+        if mode not in ('r', 'c'):
+            raise ValueError(f"Input files can only be opened read-only or copy-on-write, got mode '{mode}'!")
+        return memmap_array(self.input_file(file_id).path(), mode)
+
+    def output_memmap(self, shape, dtype='float32', file_id=None):
+        """Helper method to preallocate a memory-mapped NPY array file in the output fileset.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            Shape of the array.
+        dtype : str or numpy.dtype, optional
+            Data type of the array, defaults to ``'float32'``.
+        file_id : str, optional
+            Name of the output file. Defaults to ``None``.
+
+        Returns
+        -------
+        numpy.memmap
+            The writable memory-mapped array, call its ``flush`` method when done.
+
+        See Also
+        --------
+        romitask.arrays.open_memmap
+        """
+        from romitask.arrays import open_memmap
+        from romitask.codec import file_path
+        return open_memmap(file_path(self.output_file(file_id), "npy"), shape, dtype)
+
+    def input_chunked(self, file_id=None):
+        """Helper method to lazily read an array file in the chunked array format from the input fileset.
+
+        Parameters
+        ----------
+        file_id : str, optional
+            Name of the input file. Defaults to ``None``.
+
+        Returns
+        -------
+        romitask.arrays.ChunkedArray
+            The lazy array, indexing it only decompresses the required chunks.
+
+        See Also
+        --------
+        romitask.arrays.ChunkedArray
+        """
+        from romitask.codec import get_codec
+        return get_codec('chunked').read(self.input_file(file_id))
+
+    def output_chunked(self, arr, file_id=None, chunks=None, compress_level=6):
+        """Helper method to write an array in the chunked array format to the output fileset.
+
+        Parameters
+        ----------
+        arr : numpy.ndarray
+            The array to write, it may be a ``numpy.memmap`` larger than the available RAM.
+        file_id : str, optional
+            Name of the output file. Defaults to ``None``.
+        chunks : tuple of int, optional
+            The chunk shape, defaults to about 1MB per chunk.
+        compress_level : int or None, optional
+            The per-chunk ZIP compression level, defaults to ``6``.
+
+        Returns
+        -------
+        plantdb.fsdb.File
+            The written output file.
+
+        See Also
+        --------
+        romitask.arrays.write_chunked
+        """
+        from romitask.codec import get_codec
+        fi = self.output_file(file_id)
+        get_codec('chunked', chunks=chunks, compress_level=compress_level).write(fi, arr)
+        return fi
+
     def get_task_name(self):
         """Helper method to get the name of the current task.
 
@@ -441,9 +781,14 @@ class FilesetExists(RomiTask):
 
     def output(self):
         """The output of the task is the fileset."""
-        self.task_id = self.fileset_id  # name the task using the fileset
+        if self.scan_key == "":
+            self.task_id = self.fileset_id  # name the task using the fileset
         return super().output()
 
+    def output_fileset_id(self):
+        """The output fileset id is the ``fileset_id`` parameter."""
+        return self.fileset_id
+
     def run(self):
         """Check the fileset exist.
 
@@ -533,9 +878,14 @@ class FileExists(RomiTask):
 
     def output(self):
         """The output of the task is the fileset."""
-        self.task_id = self.fileset_id  # name the task using the fileset
+        if self.scan_key == "":
+            self.task_id = self.fileset_id  # name the task using the fileset
         return super().output()
 
+    def output_fileset_id(self):
+        """The output fileset id is the ``fileset_id`` parameter."""
+        return self.fileset_id
+
     def output_file(self, file_id=None, create=False):
         """The output file should exist."""
         if file_id is None:
@@ -640,10 +990,98 @@ class VirtualPlantObj(FileExists):
                 continue
         fs.set_metadata("task_params", params)
 
-        self.task_id = self.fileset_id
+        if self.scan_key == "":
+            self.task_id = self.fileset_id
         return t
 
 
+def match_query(metadata, query):
+    """Test if a metadata dictionary fulfill a filtering query.
+
+    Parameters
+    ----------
+    metadata : dict
+        The metadata dictionary to test.
+    query : dict
+        The filtering dictionary, all key(s) and value(s) must be found in `metadata`.
+
+    Returns
+    -------
+    bool
+        ``True`` if `metadata` fulfill the `query`, else ``False``.
+    """
+    return all(k in metadata and metadata[k] == v for k, v in query.items())
+
+
+@contextmanager
+def build_roots(tasks):
+    """Declare the root tasks of an in-process luigi build, like a ``luigi.build`` call.
+
+    Parameters
+    ----------
+    tasks : list of luigi.Task
+        The root tasks of the build.
+
+    Notes
+    -----
+    The root tasks of the ``luigi`` command line are known without it, see ``get_build_roots``.
+    """
+    global _build_roots
+    previous, _build_roots = _build_roots, list(tasks)
+    try:
+        yield
+    finally:
+        _build_roots = previous
+
+
+def get_build_roots():
+    """Return the root tasks of the current luigi build, ``None`` if unknown."""
+    if _build_roots is not None:
+        return _build_roots
+    from luigi.cmdline_parser import CmdlineParser
+    cmdline = CmdlineParser.get_instance()
+    if cmdline is None:
+        return None
+    return [cmdline.get_task_obj()]
+
+
+def count_consumers(roots):
+    """Return the number of tasks requiring each task of a DAG, without streaming.
+
+    Parameters
+    ----------
+    roots : list of luigi.Task
+        The root tasks of the DAG.
+
+    Returns
+    -------
+    dict
+        The number of consumer tasks, indexed by task id.
+    """
+    global _walking_dag
+    key = tuple(sorted(t.task_id for t in roots))
+    if key in _consumers:
+        return _consumers[key]
+    counts = {}
+    seen = set()
+    stack = list(roots)
+    _walking_dag = True  # `FileByFileTask.requires` returns the upstream task, even with `stream`
+    try:
+        while stack:
+            task = stack.pop()
+            if task.task_id in seen:
+                continue
+            seen.add(task.task_id)
+            deps = {dep.task_id: dep for dep in luigi.task.flatten(task.requires())}
+            for task_id, dep in deps.items():
+                counts[task_id] = counts.get(task_id, 0) + 1
+                stack.append(dep)
+    finally:
+        _walking_dag = False
+    _consumers[key] = counts
+    return counts
+
+
 class FileByFileTask(RomiTask):
     """Abstract task to sequentially apply a function to each ``File`` of a ``Fileset``.
 
@@ -658,59 +1096,438 @@ class FileByFileTask(RomiTask):
         A filtering dictionary to apply on input ```Fileset`` metadata.
         Key(s) and value(s) must be found in metadata to select the ``File``.
         By default, no filtering is performed, all inputs are used.
-    type : None
-        ???
-    reader : None
-        ???
-    writer : None
-        ???
+    stream : luigi.BoolParameter, optional
+        If ``True``, and the upstream task is an incomplete ``FileByFileTask``, run it in the same task
+        and process its output files as soon as they are produced.
+        Defaults to ``False``.
+    stream_queue_size : luigi.IntParameter, optional
+        Maximum number of upstream output files waiting to be processed in streaming mode.
+        Defaults to ``8``.
+    prefetch : luigi.IntParameter, optional
+        Number of input files decoded ahead by the ``reader`` in background threads, overlapping decoding & compute.
+        Defaults to ``0``, no prefetching.
+    type : str or None
+        The extension of the output files written by the ``writer``, defaults to the ``writer`` one.
+    reader : str or romitask.codec.Codec or None
+        The codec used to decode the input files before calling ``f``.
+        Defaults to ``None``, ``f`` receives the input ``File``.
+    writer : str or romitask.codec.Codec or None
+        The codec used to encode the data returned by ``f`` in an output file with the same id as the input file.
+        Defaults to ``None``, ``f`` must create and return the output ``File``.
+    reader_options : dict or None
+        Options of the ``reader`` codec, like ``{'reuse_buffer': True}``. Defaults to ``None``.
+    writer_options : dict or None
+        Options of the ``writer`` codec, like ``{'compress_level': 1}``. Defaults to ``None``.
 
     Notes
     -----
     Input `File`s metadata are copied to the target/output `File`s metadata.
 
+    The codecs are defined in ``romitask.codec``, for example ``reader = 'image'`` & ``writer = 'npy'``.
+    New codec instances are made at each run, and for each prefetched read, so they do not share their state.
+
+    The ``query`` is answered from the metadata index of the input fileset, see ``romitask.metadata``.
+
+    In streaming mode, the upstream task is not scheduled by luigi, its requirements become the requirements
+    of this task and its function ``f`` is applied in a producer thread, feeding a bounded queue.
+    The upstream task is streamed only if it is a ``FileByFileTask`` without its own ``run`` method,
+    required by this task only in the luigi build, see ``get_build_roots``.
+    Its ``run`` method is bypassed, so it gets no luigi event: no ``PROCESSING_TIME`` nor runtime history record,
+    and its files are not counted in the progress of batch runs.
+    If it is already complete when this task runs, its outputs are read instead.
+    Its output fileset is staging until all its outputs are produced, and discarded if the streaming fails.
+    Chains of streaming ``FileByFileTask`` are pipelined, with one producer thread per upstream task.
+    Both output filesets are complete when this task succeeds.
+    As ``f`` methods run concurrently, they should not share mutable state.
+
+    Examples
+    --------
+    To stream the undistorted images to the `Masks` task, add this to the TOML configuration:
+
+    .. code-block:: toml
+
+        [Masks]
+        stream = true
+
     """
     query = luigi.DictParameter(default={})
-    type = None  # ???
-    reader = None  # ???
-    writer = None  # ???
+    # Non-significant parameters do not change the `task_id`, hence the output fileset name:
+    stream = luigi.BoolParameter(default=False, significant=False)
+    stream_queue_size = luigi.IntParameter(default=8, significant=False)
+    prefetch = luigi.IntParameter(default=0, significant=False)
+    type = None  # extension of the output files written by the `writer`
+    reader = None  # codec decoding the input files, see `romitask.codec`
+    writer = None  # codec encoding the outputs of `f`, see `romitask.codec`
+    reader_options = None  # keyword arguments of the `reader` codec
+    writer_options = None  # keyword arguments of the `writer` codec
 
     def f(self, f, outfs):
         """Function applied to every file in the fileset must return a file object.
 
         Parameters
         ----------
-        f: plantdb.fsdb.FSDB.File
-            Input file.
+        f: plantdb.fsdb.FSDB.File or any
+            Input file, or its decoded content if a ``reader`` is defined.
         outfs: plantdb.fsdb.FSDB.Fileset
             Output fileset.
 
         Returns
         -------
-        plantdb.fsdb.FSDB.File
-            Tis file must be created in `outfs`.
+        plantdb.fsdb.FSDB.File or any
+            Tis file must be created in `outfs`, or the data to encode if a ``writer`` is defined.
         """
         raise NotImplementedError
 
-    def run(self):
-        """Run the task on every `File`s from a `Fileset` that fulfill the ``query``."""
-        input_fileset = self.input().get()
-        output_fileset = self.output().get()
+    def streamed_upstream(self):
+        """Return the upstream task to run in streaming mode, if any.
 
-        in_files = input_fileset.get_files(query=self.query)
-        logger.debug(f"Got {len(in_files)} input files:")
-        logger.debug(f"{', '.join([f.id for f in in_files])}")
-        logger.debug(f"Got a filtering query: '{self.query}'.")
+        Returns
+        -------
+        FileByFileTask or None
+            The upstream task instance if streaming is enabled and possible, else ``None``.
 
-        for fi in tqdm(in_files, unit="file"):
-            outfi = self.f(fi, output_fileset)
+        Notes
+        -----
+        Only depends on the DAG of the build, not on the completeness of the tasks,
+        so the requirements of this task do not change once the upstream task is complete.
+        """
+        if _walking_dag or not self.stream or self.upstream_task is None:
+            return None
+        upstream = self.upstream()
+        if not isinstance(upstream, FileByFileTask) or type(upstream).run is not FileByFileTask.run:
+            return None
+        roots = get_build_roots()
+        if roots is None or count_consumers(roots).get(upstream.task_id, 0) != 1:
+            return None  # another task requires it, so luigi runs it
+        return upstream
+
+    def requires(self):
+        """Require the upstream task, or its requirements in streaming mode."""
+        upstream = self.streamed_upstream()
+        if upstream is not None:
+            return upstream.requires()
+        return super().requires()
+
+    def input_files(self):
+        """Iterate over the input `File`s fulfilling the ``query``.
+
+        Yields
+        ------
+        plantdb.fsdb.File
+            An input file, as soon as it is available in streaming mode.
+        """
+        upstream = self.streamed_upstream()
+        if self.stream and upstream is None:
+            logger.info(f"Can not stream the outputs of the upstream task of '{self.get_task_name()}'.")
+        if upstream is None or upstream.complete():
+            input_target = self.input() if upstream is None else upstream.output()
+            in_files = query_files(input_target.get(), self.query)
+            logger.debug(f"Got {len(in_files)} input files:")
+            logger.debug(f"{', '.join([f.id for f in in_files])}")
+            logger.debug(f"Got a filtering query: '{self.query}'.")
+            yield from in_files
+            return
+
+        logger.info(f"Streaming output files of upstream task '{upstream.get_task_name()}'...")
+        # The upstream task gets no luigi event, stage & commit its outputs here, as `prepare_start` & co:
+        stage_output(upstream)
+        q = queue.Queue(maxsize=max(1, self.stream_queue_size))
+        done = object()  # sentinel marking the end of the upstream outputs
+        errors = []
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for outfi in upstream.output_files():
+                    if stop.is_set():
+                        return
+                    q.put(outfi)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                q.put(done)
+
+        producer = threading.Thread(target=produce, name=f"stream-{upstream.get_task_name()}", daemon=True)
+        producer.start()
+        streamed = False
+        try:
+            while True:
+                fi = q.get()
+                if fi is done:
+                    break
+                if match_query(fi.get_metadata(), self.query):
+                    yield fi
+            if errors:
+                raise errors[0]
+            streamed = True
+        finally:
+            stop.set()
+            # Unblock the producer if this generator is closed early:
+            while producer.is_alive():
+                try:
+                    q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            producer.join()
+            if streamed:
+                store_summary(upstream)
+                commit_output(upstream)
+            else:
+                # Failed in either thread, or closed early, the upstream outputs are partial:
+                try:
+                    discard_output(upstream)
+                except Exception as e:
+                    logger.error(f"Could not discard the outputs of the streamed task '{upstream.task_id}': {e}")
+
+    def decoded_input_files(self, reader):
+        """Iterate over the input `File`s and their content decoded by the `reader`.
+
+        Parameters
+        ----------
+        reader : romitask.codec.Codec or None
+            The codec to use, if ``None`` the content is the ``File`` itself.
+
+        Yields
+        ------
+        plantdb.fsdb.File
+            An input file.
+        any
+            The decoded content of the input file.
+        """
+        if reader is None:
+            for fi in self.input_files():
+                yield fi, fi
+            return
+        if self.prefetch <= 0:
+            for fi in self.input_files():
+                yield fi, reader.read(fi)
+            return
+        # Decode up to `prefetch` files ahead in background threads, in input order.
+        # A decoded content may be overwritten by the next read of its codec (e.g. `reuse_buffer`),
+        # so rotate over `prefetch + 1` codecs: the one of the yielded file is not used until `f` returns.
+        from romitask.codec import get_codec
+        readers = [reader] + [get_codec(reader) for _ in range(self.prefetch)]
+        with ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix="prefetch") as pool:
+            pending = deque()
+            for i, fi in enumerate(self.input_files()):
+                pending.append((fi, pool.submit(readers[i % len(readers)].read, fi)))
+                if len(pending) > self.prefetch:
+                    fi, future = pending.popleft()
+                    yield fi, future.result()
+            while pending:
+                fi, future = pending.popleft()
+                yield fi, future.result()
+
+    def get_reader(self):
+        """Return a new instance of the ``reader`` codec with the ``reader_options``, ``None`` if not defined."""
+        if self.reader is None:
+            return None
+        from romitask.codec import get_codec
+        return get_codec(self.reader, **(self.reader_options or {}))
+
+    def get_writer(self):
+        """Return a new instance of the ``writer`` codec with the ``writer_options``, ``None`` if not defined.
+
+        The ``type`` sets the extension of the output files, if defined.
+        """
+        if self.writer is None:
+            return None
+        from romitask.codec import get_codec
+        options = dict(self.writer_options or {})
+        if self.type is not None:
+            options['ext'] = self.type
+        return get_codec(self.writer, **options)
+
+    def output_files(self):
+        """Apply ``f`` to every input `File` and iterate over the created output `File`s.
+
+        Yields
+        ------
+        plantdb.fsdb.File
+            An output file, as soon as it is created.
+        """
+        reader = self.get_reader()
+        writer = self.get_writer()
+        output_fileset = self.output().get()
+        for fi, x in self.decoded_input_files(reader):
+            outfi = self.f(x, output_fileset)
+            if writer is not None and outfi is not None:
+                data = outfi
+                outfi = output_fileset.create_file(fi.id)
+                writer.write(outfi, data)
             if outfi is not None:
                 m = fi.get_metadata()
                 outm = outfi.get_metadata()
                 outfi.set_metadata({**m, **outm})
+                yield outfi
+
+    def run(self):
+        """Run the task on every `File`s from a `Fileset` that fulfill the ``query``."""
+        # The per-task progress bar is replaced by the aggregated progress of batch runs, if any:
+        n_files, t_notify = 0, time.time()
+        for _ in tqdm(self.output_files(), unit="file", disable=progress.enabled()):
+            n_files += 1
+            if time.time() - t_notify > 1.:
+                progress.notify('files', n=n_files)
+                n_files, t_notify = 0, time.time()
+        progress.notify('files', n=n_files)
         return
 
 
+@RomiTask.event_handler(luigi.Event.DEPENDENCY_DISCOVERED)
+def announce_dependency(task, dependency):
+    """Announce the tasks to run to the progress monitor of batch runs, see ``romitask.progress``."""
+    tasks = [task.task_id]
+    if isinstance(dependency, RomiTask):
+        tasks.append(dependency.task_id)
+    progress.notify('discovered', tasks=tasks)
+
+
+@RomiTask.event_handler(luigi.Event.DEPENDENCY_PRESENT)
+def announce_complete(task):
+    """Announce the already complete tasks to the progress monitor of batch runs, see ``romitask.progress``."""
+    progress.notify('present', task=task.task_id)
+
+
+@RomiTask.event_handler(luigi.Event.START)
+def prepare_start(task):
+    """When a task starts, connect to the database, stage its outputs & announce it.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which is starting.
+    """
+    connect_worker_db(task)
+    stage_output(task)
+    progress.notify('start', task=task.task_id)
+
+
+def owned_output(task):
+    """Return the output target owned by a task.
+
+    Parameters
+    ----------
+    task : RomiTask
+        A ROMI task.
+
+    Returns
+    -------
+    FilesetTarget or None
+        The output fileset target, ``None`` if the task does not output a fileset,
+        or checks the existence of filesets or files it does not own.
+    """
+    if isinstance(task, (FilesetExists, FileExists)):
+        return None
+    target = task.output()
+    return target if isinstance(target, FilesetTarget) else None
+
+
+def stage_output(task):
+    """Mark the output fileset of a starting task as staging, so it is not complete until the task succeeds.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which is starting.
+
+    Notes
+    -----
+    The outputs left by an interrupted run of the task, still marked as staging, are discarded first.
+    See ``FilesetTarget.exists``.
+    """
+    target = owned_output(task)
+    if target is None:
+        return
+    fs = target.get()
+    if fs.get_metadata(STAGING_MD) and len(fs.get_files()) > 0:
+        logger.warning(f"Discarding the outputs of an interrupted run of task '{target.fileset_id}'.")
+        target.scan.delete_fileset(fs.id)
+        task._output_target = None  # re-create the fileset with its metadata
+        fs = task.output().get()
+    fs.set_metadata(STAGING_MD, True)
+
+
+def commit_output(task):
+    """Mark the output fileset of a succeeded task as complete.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which has succeeded.
+    """
+    target = owned_output(task)
+    if target is None:
+        return
+    fs = target.get(create=False)
+    if fs is not None:
+        fs.set_metadata(STAGING_MD, False)
+
+
+def discard_output(task):
+    """Delete the staging output fileset of a failed task.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which has failed.
+    """
+    target = owned_output(task)
+    if target is None:
+        return
+    fs = target.get(create=False)
+    if fs is not None and fs.get_metadata(STAGING_MD):
+        target.scan.delete_fileset(fs.id)
+
+
+def connect_worker_db(task):
+    """Reconnect to the database when a task starts in a forked luigi worker process.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which is starting.
+
+    Notes
+    -----
+    With several luigi workers (``--workers N``), tasks run in forked processes.
+    The inherited global `db` only knows the filesets created before the fork, not the ones written since by the
+    upstream tasks, so a fresh connection is made from the scan index reconciled with the disk, under the scan lock.
+    """
+    global db, _db_pid, _worker_db
+    if db is None or _db_pid == os.getpid():
+        return
+    from plantdb import FSDB
+    db_config = DatabaseConfig()
+    scan_id = db_config.scan.id
+    with scan_lock(db_config.scan.path()):
+        repair_scan_index(db_config.scan.path())
+        db = FSDB(db.basedir)
+        # The parent process holds the database lock:
+        db.connect(unsafe=True)
+    _db_pid = os.getpid()
+    _worker_db = True
+    db_config.scan = db.get_scan(scan_id)
+
+
+def sync_worker_scan_index():
+    """Restore the filesets & files dropped from the scan index by concurrent luigi worker processes.
+
+    Notes
+    -----
+    The ``plantdb.fsdb.FSDB`` API rewrites the whole scan index file from its in-memory state,
+    so a concurrent task may remove the filesets or files written meanwhile by another one.
+    Called once a task ends in a luigi worker process, see ``romitask.concurrency.repair_scan_index``.
+    """
+    if not _worker_db:
+        return
+    scan_path = DatabaseConfig().scan.path()
+    with scan_lock(scan_path):
+        restored = repair_scan_index(scan_path)
+    if restored:
+        logger.debug(f"Repaired filesets {', '.join(restored)} in the scan index.")
+
+
 @RomiTask.event_handler(luigi.Event.FAILURE)
 def mourn_failure(task, exception):
     """In the case of failure of a task, remove the corresponding fileset from the database.
@@ -724,10 +1541,128 @@ def mourn_failure(task, exception):
     """
     # Log the failure:
     logger.critical(exception)
-    # Delete the task fileset:
-    #output_fileset = task.output().get()
-    #scan = task.output().get().scan
-    #scan.delete_fileset(output_fileset.id)
+    # Delete the partially written task fileset:
+    try:
+        discard_output(task)
+    except Exception as e:
+        logger.error(f"Could not discard the outputs of the failed task '{task.task_id}': {e}")
+    sync_worker_scan_index()
+    progress.notify('failed', task=task.task_id)
+
+
+@RomiTask.event_handler(luigi.Event.SUCCESS)
+def celebrate_success(task):
+    """In the case of success of a task, store the summary of its outputs, commit them & announce it.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which has succeeded.
+    """
+    store_summary(task)
+    commit_output(task)
+    sync_worker_scan_index()
+    progress.notify('done', task=task.task_id)
+
+
+def task_params(task):
+    """Return the significant parameters of a task, without its ``scan_key``, e.g. to compare runs on several scans.
+
+    Parameters
+    ----------
+    task : luigi.Task
+        The task to get the parameters of.
+
+    Returns
+    -------
+    dict
+        The serialized parameter values, indexed by name.
+    """
+    params = dict(task.to_str_params(only_significant=True))
+    params.pop('scan_key', None)
+    return params
+
+
+@RomiTask.event_handler(luigi.Event.PROCESSING_TIME)
+def record_runtime(task, processing_time):
+    """Record the duration of a task in the historical runtime database, and flag abnormally slow runs.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which has been run.
+    processing_time : float
+        The duration of the task, in seconds.
+
+    Notes
+    -----
+    The scan size is given by its number of images and, for tasks with PLY inputs, by their number of points.
+    See ``romitask.history``.
+    The history file is read once per process, the records are then appended to it.
+    """
+    from romitask.history import RuntimeHistory
+    from romitask.history import format_duration
+    from romitask.history import params_hash
+    from romitask.history import scan_size
+    global _history
+    try:
+        size = scan_size(DatabaseConfig().scan.path())
+        inputs = task.input()
+        if isinstance(inputs, FilesetTarget):
+            size['points'] = _input_points(inputs)
+        family = task.get_task_family()
+        params = params_hash(task_params(task))
+        if _history is None:
+            _history = RuntimeHistory()
+        history = _history
+        predicted = history.is_slow('task', family, processing_time, size, params)
+        if predicted is not None:
+            logger.warning(f"Task '{family}' was abnormally slow: it took {format_duration(processing_time)}, "
+                           f"{format_duration(predicted)} expected from its history!")
+        history.add('task', family, processing_time, size, params)
+    except Exception as e:
+        # Failing to record the runtime should never fail the task:
+        logger.debug(f"Could not record the runtime of task '{task.task_id}': {e}")
+
+
+def _input_points(target):
+    """Return the total number of points of the PLY files of an input fileset, from their headers."""
+    from romitask.ply import read_ply_header
+    fs = target.get(create=False)
+    if fs is None:
+        return 0
+    paths = [f.path() for f in fs.get_files()]
+    return sum(read_ply_header(p).counts().get('vertex', 0) for p in paths if Path(p).suffix == '.ply')
+
+
+def store_summary(task):
+    """In the case of success of a task, store a summary of its outputs in the fileset metadata.
+
+    Parameters
+    ----------
+    task : RomiTask
+        The task which has succeeded.
+
+    Notes
+    -----
+    The summary is stored under a 'summary' entry, see ``romitask.summary``.
+    Tasks checking the existence of filesets or files do not own them, no summary is stored.
+    """
+    from romitask.summary import SUMMARY_MD
+    from romitask.summary import make_summary
+    target = owned_output(task)
+    if target is None:
+        return
+    fs = target.get(create=False)
+    if fs is None:
+        return
+    try:
+        summary = make_summary(task.get_task_name(), target.fileset_id, str(target.scan.path()))
+    except Exception as e:
+        # Failing to summarize the outputs should never fail the task:
+        logger.warning(f"Could not compute the summary of task '{target.fileset_id}': {e}")
+        return
+    fs.set_metadata(SUMMARY_MD, summary)
 
 
 class DummyTask(RomiTask):
@@ -851,8 +1786,11 @@ class Clean(RomiTask):
             logger.critical(f"Could not get the 'image' fileset for '{scan.id}'!")
         else:
             logger.info("Cleaning 'images' Fileset metadata...")
+            md_index = fileset_metadata_index(img_fs)
             for f in tqdm(img_fs.get_files(), unit='file'):
-                md = f.get_metadata()
+                md = f.get_metadata() if md_index is None else md_index.metadata(f.id)
+                if set(md) <= set(keep_metadata):
+                    continue  # nothing to remove, avoid rewriting its metadata file
                 clean_md = {k: v for k, v in md.items() if k in keep_metadata}
                 f.metadata = {}  # need to clear all metadata before setting the clean ones
                 f.set_metadata(clean_md)